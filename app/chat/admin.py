@@ -1,24 +1,201 @@
+import uuid
+from collections import defaultdict
+
+from cryptography.fernet import InvalidToken
 from django.contrib import admin
-from chat.models import Message, Room, DirectThread, DirectMessage
+from django.contrib.admin.views.main import ORDER_VAR, ChangeList
+from django.core.paginator import Paginator
+from django.db import connection
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+from chat.models import Message, Room, DirectThread, DirectMessage, get_fernet
+from chat.previews import previews, PREVIEW_LEN, ROOM
+
+CURSOR_VAR = "cursor"
+# below this many rows a real COUNT(*) is cheap enough
+ESTIMATE_THRESHOLD = 100_000
+
+
+class EstimatedCountPaginator(Paginator):
+    """Unfiltered changelists on Postgres read the planner's row estimate instead of COUNT(*)."""
+
+    estimated = False
+
+    @cached_property
+    def count(self):
+        query = getattr(self.object_list, "query", None)
+        if query is not None and not query.where and connection.vendor == "postgresql":
+            with connection.cursor() as cur:
+                cur.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", [query.model._meta.db_table])
+                row = cur.fetchone()
+            if row and row[0] >= ESTIMATE_THRESHOLD:
+                self.estimated = True
+                return row[0]
+        return super().count
+
+
+class KeysetChangeList(ChangeList):
+    """
+    Newest-first changelist paged by `?cursor=<last id>` (id < cursor) instead of
+    OFFSET, so page 5000 costs the same as page 1. Sorting by a column falls back
+    to the regular numbered pages.
+    """
+
+    def __init__(self, request, *args, **kwargs):
+        try:
+            self.cursor = int(request.GET.get(CURSOR_VAR, ""))
+        except ValueError:
+            self.cursor = None
+        self.next_cursor = None
+        self.keyset = ORDER_VAR not in request.GET
+        super().__init__(request, *args, **kwargs)
+
+    def get_filters_params(self, params=None):
+        lookup_params = super().get_filters_params(params)
+        lookup_params.pop(CURSOR_VAR, None)
+        return lookup_params
+
+    def get_query_string(self, new_params=None, remove=None):
+        # filter/search/sort links start again from the newest page
+        if CURSOR_VAR not in (new_params or {}):
+            remove = [*(remove or []), CURSOR_VAR]
+        return super().get_query_string(new_params, remove)
+
+    def get_results(self, request):
+        if not self.keyset:
+            super().get_results(request)
+        else:
+            self.paginator = self.model_admin.get_paginator(request, self.queryset, self.list_per_page)
+            self.result_count = self.paginator.count
+            self.full_result_count = None
+            self.show_full_result_count = False
+            self.show_admin_actions = True
+            self.can_show_all = False
+
+            queryset = self.queryset
+            if self.cursor is not None:
+                queryset = queryset.filter(pk__lt=self.cursor)
+            rows = list(queryset.order_by("-pk")[:self.list_per_page + 1])
+            if len(rows) > self.list_per_page:
+                rows = rows[:self.list_per_page]
+                self.next_cursor = rows[-1].pk
+            self.result_list = rows
+            self.multi_page = self.cursor is not None or self.next_cursor is not None
+
+        self.count_estimated = self.paginator.estimated
+        self.result_list = self.model_admin.prepare_results(list(self.result_list))
+
+    @property
+    def newest_url(self):
+        return self.get_query_string()
+
+    @property
+    def older_url(self):
+        return self.get_query_string({CURSOR_VAR: self.next_cursor})
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    ordering = ("-id",)
+    search_help_text = "Message id or exact sender username"
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
+
+    def prepare_results(self, rows):
+        return rows
+
+    def get_search_results(self, request, queryset, search_term):
+        # indexed lookups only; ILIKE over millions of (encrypted) rows is useless
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        if term.isdigit():
+            return queryset.filter(pk=int(term)), False
+        return queryset.filter(sender__username=term), False
+
 
 @admin.register(Message)
-class MessageAdmin(admin.ModelAdmin):
-    pass
+class MessageAdmin(LargeTableAdmin):
+    list_display = ("id", "room", "sender", "preview", "created_at")
+    list_select_related = ("room", "sender")
+    search_fields = ("=sender__username",)
+    autocomplete_fields = ("room", "sender")
+    raw_id_fields = ("reply_to", "attachment")
+
+    def prepare_results(self, rows):
+        """Decrypt the page in one pass: cached previews first, then one MultiFernet per room key."""
+        by_key = defaultdict(list)
+        for m in rows:
+            cached = previews.get(ROOM, m.pk, m.room_id)
+            if cached is not None:
+                m.preview_text = cached[1]
+            elif m.room_id and m.room.encryption_key:
+                by_key[(m.room.encryption_key, m.room.previous_keys)].append(m)
+            else:
+                m.preview_text = m.message[:PREVIEW_LEN]
+
+        for (key, previous_keys), batch in by_key.items():
+            fernet = get_fernet(key, previous_keys)
+            for m in batch:
+                try:
+                    text = fernet.decrypt(m.message.encode()).decode()
+                except InvalidToken:
+                    m.preview_text = "(cannot decrypt)"
+                    continue
+                previews.put(ROOM, m.pk, m.room_id, m.sender.username if m.sender_id else None, text)
+                m.preview_text = text[:PREVIEW_LEN]
+        return rows
+
+    @admin.display(description="message")
+    def preview(self, obj):
+        text = getattr(obj, "preview_text", "")
+        return (text[:60] + "…") if len(text) > 60 else text
 
 @admin.register(Room)
 class RoomAdmin(admin.ModelAdmin):
-    pass
+    actions = ["rotate_encryption_key"]
+    list_display = ("name", "slug", "creator")
+    list_select_related = ("creator",)
+    search_fields = ("name", "slug")
+    autocomplete_fields = ("creator", "granted_users")
+
+    @admin.action(description="Rotate encryption key (then run manage.py reencrypt_rooms)")
+    def rotate_encryption_key(self, request, queryset):
+        for room in queryset:
+            room.rotate_key()
+        self.message_user(request, f"Rotated {len(queryset)} room key(s); run `manage.py reencrypt_rooms` to re-encrypt old messages.")
 
 @admin.register(DirectThread)
 class DirectThreadAdmin(admin.ModelAdmin):
     list_display = ("uuid", "user_a", "user_b", "last_message_at", "created_at")
-    search_fields = ("uuid", "user_a__username", "user_b__username")
+    list_select_related = ("user_a", "user_b")
+    search_fields = ("=uuid", "=user_a__username", "=user_b__username")
+    search_help_text = "Thread uuid or exact username"
+    autocomplete_fields = ("user_a", "user_b")
+    ordering = ("-id",)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        try:
+            return queryset.filter(uuid=uuid.UUID(term)), False
+        except ValueError:
+            return queryset.filter(Q(user_a__username=term) | Q(user_b__username=term)), False
 
 @admin.register(DirectMessage)
-class DirectMessageAdmin(admin.ModelAdmin):
+class DirectMessageAdmin(LargeTableAdmin):
     list_display = ("id", "thread", "sender", "short_msg", "created_at")
-    list_filter = ("thread",)
-    search_fields = ("message", "sender__username")
+    list_select_related = ("thread", "sender")
+    list_filter = ("created_at",)
+    search_fields = ("=sender__username",)
+    autocomplete_fields = ("thread", "sender")
+    raw_id_fields = ("reply_to", "attachment")
 
     def short_msg(self, obj):
-        return (obj.message[:60] + "…") if len(obj.message) > 60 else obj.message
\ No newline at end of file
+        return (obj.message[:60] + "…") if len(obj.message) > 60 else obj.message
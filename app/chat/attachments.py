@@ -0,0 +1,262 @@
+"""
+File attachments: resumable chunked uploads, content-addressed storage and
+X-Accel-Redirect downloads.
+
+    ATTACHMENT_ROOT/ab/cd/<sha256>          the file
+    ATTACHMENT_ROOT/ab/cd/<sha256>.thumb    JPEG thumbnail (images only)
+    ATTACHMENT_ROOT/tmp/<upload uuid>.part  upload in progress
+
+An upload is created for a room or thread the user belongs to, filled with
+PUTs carrying an Upload-Offset header (a retry just resends from the offset
+the server reports) and hashed once complete. Identical bytes are stored
+once. The finished upload id is then sent with a websocket message, which
+consumes it.
+
+Downloads are authorized against the message's room/thread and handed to
+nginx with X-Accel-Redirect (nginx also does Range requests), so file bytes
+never pass through Python. Without nginx (ATTACHMENT_X_ACCEL = False) Django
+serves the file itself.
+"""
+import hashlib
+import multiprocessing
+import os
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Optional
+from urllib.parse import quote
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.http import FileResponse, HttpResponse
+
+from . import metrics, thumbnails
+from .models import Attachment, Upload
+
+try:
+    import PIL  # noqa: F401  (thumbnails are skipped without Pillow)
+except ImportError:
+    PIL = None
+
+ATTACHMENT_ROOT = getattr(settings, "ATTACHMENT_ROOT", os.path.join(settings.BASE_DIR, "attachments"))
+ATTACHMENT_MAX_SIZE = getattr(settings, "ATTACHMENT_MAX_SIZE", 50 * 1024 * 1024)
+ATTACHMENT_CHUNK_SIZE = getattr(settings, "ATTACHMENT_CHUNK_SIZE", 4 * 1024 * 1024)
+ATTACHMENT_X_ACCEL = getattr(settings, "ATTACHMENT_X_ACCEL", True)
+ATTACHMENT_X_ACCEL_PREFIX = getattr(settings, "ATTACHMENT_X_ACCEL_PREFIX", "/protected-attachments/")
+ATTACHMENT_THUMB_SIZE = getattr(settings, "ATTACHMENT_THUMB_SIZE", (320, 320))
+ATTACHMENT_THUMB_WORKERS = getattr(settings, "ATTACHMENT_THUMB_WORKERS", 2)
+
+READ_BLOCK = 64 * 1024
+
+# Only these are ever served inline (sniffed from the bytes, not the client's claim)
+IMAGE_SIGNATURES = (
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+)
+
+
+class UploadError(Exception):
+    def __init__(self, message, status=400, offset=None):
+        super().__init__(message)
+        self.status = status
+        self.offset = offset
+
+
+def relative_path(sha256: str) -> str:
+    return f"{sha256[:2]}/{sha256[2:4]}/{sha256}"
+
+
+def blob_path(sha256: str) -> str:
+    return os.path.join(ATTACHMENT_ROOT, relative_path(sha256))
+
+
+def part_path(upload_id) -> str:
+    return os.path.join(ATTACHMENT_ROOT, "tmp", f"{upload_id}.part")
+
+
+def sniff_content_type(head: bytes) -> str:
+    for signature, content_type in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return content_type
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    return "application/octet-stream"
+
+
+def write_chunk(upload_id, user_id: int, offset: int, stream) -> Upload:
+    """
+    Append the request body at `offset`. The offset must equal what the server
+    already has; otherwise UploadError(409) carries the offset to resume from.
+    """
+    with transaction.atomic():
+        try:
+            upload = Upload.objects.select_for_update().get(pk=upload_id, user_id=user_id)
+        except (Upload.DoesNotExist, ValueError):
+            raise UploadError("unknown upload", status=404)
+        if upload.attachment_id:
+            return upload
+        if offset != upload.received:
+            raise UploadError("offset mismatch", status=409, offset=upload.received)
+
+        limit = min(ATTACHMENT_CHUNK_SIZE, upload.size - upload.received)
+        written = 0
+        path = part_path(upload.pk)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "r+b" if os.path.exists(path) else "wb") as f:
+            f.seek(offset)
+            while True:
+                block = stream.read(READ_BLOCK)
+                if not block:
+                    break
+                written += len(block)
+                if written > limit:
+                    raise UploadError("chunk too large", status=413, offset=upload.received)
+                f.write(block)
+            f.truncate()   # drop leftovers of an earlier, interrupted chunk
+
+        upload.received += written
+        upload.save(update_fields=["received"])
+
+        # still under the row lock: a retried final chunk waits here and then
+        # sees attachment_id set instead of finishing the same .part twice
+        if upload.received == upload.size:
+            finish_upload(upload)
+    return upload
+
+
+def finish_upload(upload: Upload) -> Attachment:
+    """Hash the assembled file and record it; the file moves into place once that commits."""
+    path = part_path(upload.pk)
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        head = f.read(READ_BLOCK)
+        block = head
+        while block:
+            digest.update(block)
+            block = f.read(1024 * 1024)
+    sha256 = digest.hexdigest()
+
+    created = False
+    attachment = Attachment.objects.filter(sha256=sha256).first()
+    if attachment is not None:
+        metrics.incr("attachments.dedup_hits")
+    else:
+        try:
+            with transaction.atomic():
+                attachment = Attachment.objects.create(sha256=sha256, size=upload.size, content_type=sniff_content_type(head))
+        except IntegrityError:
+            # same bytes finished concurrently
+            attachment = Attachment.objects.get(sha256=sha256)
+        else:
+            created = True
+
+    # the .part only leaves tmp/ once the rows are committed: after a rollback
+    # the upload resumes from it and no blob is left behind without its row
+    transaction.on_commit(partial(store_part, path, sha256))
+    if created and attachment.content_type.startswith("image/"):
+        # the worker reads the blob and marks the row by id; both exist by then
+        transaction.on_commit(partial(schedule_thumbnail, attachment))
+
+    upload.attachment = attachment
+    upload.save(update_fields=["attachment"])
+    return attachment
+
+
+def store_part(path: str, sha256: str):
+    """Move a finished .part to its blob path, or drop it if those bytes are already stored."""
+    dest = blob_path(sha256)
+    try:
+        if os.path.exists(dest):
+            os.remove(path)
+        else:
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            os.replace(path, dest)
+    except FileNotFoundError:
+        pass   # already moved by a retry that committed first
+
+
+def parse_upload_id(value) -> Optional[uuid.UUID]:
+    try:
+        return uuid.UUID(str(value)) if value else None
+    except ValueError:
+        return None
+
+
+def claim_upload(upload_id: uuid.UUID, user_id: int, room_id: int) -> Optional[tuple]:
+    """
+    Consume a finished room upload: (attachment, filename), or None if it is
+    not this user's, not for this room, unfinished or already used.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"DELETE FROM {Upload._meta.db_table} "
+            f"WHERE id = %s AND user_id = %s AND room_id = %s AND attachment_id IS NOT NULL "
+            f"RETURNING attachment_id, filename",
+            [upload_id.hex, user_id, room_id],
+        )
+        row = cursor.fetchone()
+    if row is None:
+        return None
+    return Attachment.objects.get(pk=row[0]), row[1]
+
+
+def attachment_payload(kind: str, message_id: int, attachment: Attachment, name: str) -> dict:
+    url = f"/chat/attachments/{kind}/{message_id}/"
+    return {
+        "url": url,
+        "thumbnail_url": f"{url}?thumb=1" if attachment.has_thumbnail else None,
+        "name": name,
+        "size": attachment.size,
+        "content_type": attachment.content_type,
+    }
+
+
+def serve(attachment: Attachment, name: str, thumbnail: bool = False) -> HttpResponse:
+    relative = relative_path(attachment.sha256) + (".thumb" if thumbnail else "")
+    content_type = "image/jpeg" if thumbnail else attachment.content_type
+    inline = content_type.startswith("image/")
+
+    if ATTACHMENT_X_ACCEL:
+        response = HttpResponse(content_type=content_type)
+        response["X-Accel-Redirect"] = ATTACHMENT_X_ACCEL_PREFIX + relative
+    else:
+        response = FileResponse(open(os.path.join(ATTACHMENT_ROOT, relative), "rb"), content_type=content_type)
+    response["Content-Disposition"] = (
+        f"{'inline' if inline else 'attachment'}; filename*=UTF-8''{quote(name or attachment.sha256)}"
+    )
+    response["X-Content-Type-Options"] = "nosniff"
+    # content-addressed: the bytes behind this URL never change
+    response["Cache-Control"] = "private, max-age=31536000, immutable"
+    return response
+
+
+_thumbnail_pool = None
+
+
+def schedule_thumbnail(attachment: Attachment):
+    global _thumbnail_pool
+    if PIL is None:
+        return
+    if _thumbnail_pool is None:
+        # spawn, not fork: the web process has threads and open sockets
+        _thumbnail_pool = ProcessPoolExecutor(
+            max_workers=ATTACHMENT_THUMB_WORKERS, mp_context=multiprocessing.get_context("spawn")
+        )
+    src = blob_path(attachment.sha256)
+    future = _thumbnail_pool.submit(thumbnails.render_thumbnail, src, f"{src}.thumb", tuple(ATTACHMENT_THUMB_SIZE))
+    future.add_done_callback(partial(_thumbnail_done, attachment.pk))
+
+
+def _thumbnail_done(attachment_id: int, future):
+    # runs on the pool's management thread, outside any request
+    try:
+        future.result()
+    except Exception:
+        metrics.incr("attachments.thumbnail_errors")
+        return
+    try:
+        Attachment.objects.filter(pk=attachment_id).update(has_thumbnail=True)
+    finally:
+        connection.close()
@@ -0,0 +1,121 @@
+"""
+Opt-in capture of inbound websocket traffic, for `manage.py replay_ws`.
+
+With WS_CAPTURE_PATH set, the room and DM consumers append one JSON line per
+event to that file (`{pid}` in the path is replaced by the worker's pid):
+
+  {"t": 1718000000.123, "ev": "open",  "conn": "9f0c...", "kind": "chat", "target": "lobby", "user": 7, "proto": null}
+  {"t": ..., "ev": "frame", "conn": "9f0c...", "seq": 3, "data": {"message_len": 42, "reply_to": 1001}}
+  {"t": ..., "ev": "stored", "conn": "9f0c...", "seq": 3, "id": 1017}
+  {"t": ..., "ev": "close", "conn": "9f0c...", "code": 1001}
+
+Message text is never written, only its length; attachments become a flag
+and unknown keys are dropped. `stored` ties a frame to the message id it
+created so replay can rebuild reply chains. WS_CAPTURE_SAMPLE picks the
+fraction of connections recorded. Lines are buffered in memory and written
+every WS_CAPTURE_FLUSH_EVERY seconds with one O_APPEND write, so workers can
+share a file. With capture off the hooks cost one attribute check.
+"""
+import asyncio
+import json
+import os
+import random
+import time
+import uuid
+from typing import Optional
+
+from django.conf import settings
+
+from . import metrics
+
+WS_CAPTURE_PATH = getattr(settings, "WS_CAPTURE_PATH", None)
+WS_CAPTURE_SAMPLE = getattr(settings, "WS_CAPTURE_SAMPLE", 1.0)
+WS_CAPTURE_FLUSH_EVERY = getattr(settings, "WS_CAPTURE_FLUSH_EVERY", 1.0)   # seconds
+
+# copied as-is; everything else in a frame is dropped
+_PLAIN_KEYS = ("action", "active", "read", "delivered", "last_id", "reply_to", "reply_to_id")
+
+
+def redact(data: dict) -> dict:
+    out = {k: data[k] for k in _PLAIN_KEYS if k in data}
+    if isinstance(data.get("message"), str):
+        out["message_len"] = len(data["message"])
+    if data.get("attachment"):
+        out["attachment"] = True
+    return out
+
+
+class CaptureWriter:
+    def __init__(self, path: str):
+        self.path = path.replace("{pid}", str(os.getpid()))
+        self._lines: list = []
+        self._fd: Optional[int] = None
+        self._flusher = None
+        self.broken = False
+
+    def write(self, record: dict):
+        self._lines.append(json.dumps(record, separators=(",", ":")))
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.get_running_loop().create_task(self._flush_forever())
+
+    def flush(self):
+        if not self._lines or self.broken:
+            return
+        data = ("\n".join(self._lines) + "\n").encode()
+        self._lines = []
+        try:
+            if self._fd is None:
+                self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+            os.write(self._fd, data)
+        except OSError:
+            # disk full / bad path: stop capturing rather than break the sockets
+            self.broken = True
+            metrics.incr("capture.errors")
+
+    async def _flush_forever(self):
+        while not self.broken:
+            await asyncio.sleep(WS_CAPTURE_FLUSH_EVERY)
+            self.flush()
+
+
+# One per process; only touched from the event loop.
+writer = CaptureWriter(WS_CAPTURE_PATH) if WS_CAPTURE_PATH else None
+
+
+class CaptureMixin:
+    """
+    Goes before OutboundMixin in the consumer bases. Expects `room_name` (room
+    slug / thread uuid) and `outbound_kind` on the consumer.
+    """
+    _capture_conn: Optional[str] = None
+
+    async def accept_negotiated(self):
+        await super().accept_negotiated()
+        if writer is None or writer.broken or random.random() >= WS_CAPTURE_SAMPLE:
+            return
+        self._capture_conn = uuid.uuid4().hex[:16]
+        self._capture_seq = 0
+        user = self.scope.get("user")
+        self._capture("open", kind=self.outbound_kind, target=self.room_name,
+                      user=getattr(user, "id", None), proto=self.scope.get("subprotocols") or None)
+
+    def decode_frame(self, text_data=None, bytes_data=None) -> Optional[dict]:
+        data = super().decode_frame(text_data, bytes_data)
+        if self._capture_conn is not None and data is not None:
+            self._capture_seq += 1
+            self._capture("frame", seq=self._capture_seq, data=redact(data))
+        return data
+
+    def capture_stored(self, message_id: int):
+        """The frame being handled created message `message_id`."""
+        if self._capture_conn is not None:
+            self._capture("stored", seq=self._capture_seq, id=message_id)
+
+    async def websocket_disconnect(self, message):
+        if self._capture_conn is not None:
+            self._capture("close", code=message.get("code"))
+            self._capture_conn = None
+        await super().websocket_disconnect(message)
+
+    def _capture(self, ev: str, **fields):
+        writer.write({"t": round(time.time(), 4), "ev": ev, "conn": self._capture_conn, **fields})
@@ -1,37 +1,106 @@
-import json
 from channels.db import database_sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
 from django.contrib.auth import get_user_model
-from django.core.exceptions import ObjectDoesNotExist
-from .models import Message, Room, DirectMessage, DirectThread
+from .models import Message, DirectMessage, DirectThread, normalize_room_name
+from .registry import registry, RoomInfo
+from . import membership
+from .outbound import OutboundMixin
+from .capture import CaptureMixin
+from .profiling import ProfileMixin
+from .drain import DrainMixin
+from .local_delivery import LocalGroupMixin, LocalFirstSender
+from .throttle import FrameThrottle, throttled_payload
+from .typing_indicator import TypingTracker
+from . import receipts
+from . import attachments
+from . import inbox
+from .previews import previews, ROOM, DM
+from .utils import resolve_reply_previews
 import asyncio
-from redis.asyncio import Redis
+from django.db import transaction
+from .redis_client import REDIS
 from django.conf import settings
 from datetime import datetime, timezone
+from functools import partial
 from typing import Optional, Set
 
 User = get_user_model()
 
+# Reconnect catch-up (`sync` action): rows per reply frame, and how many rows a
+# connection may pull in total before the client is told to reload instead.
+SYNC_BATCH = getattr(settings, "WS_SYNC_BATCH", 100)
+SYNC_MAX = getattr(settings, "WS_SYNC_MAX", 1000)
+
+
+def layer_alias(group_prefix: str, default: str) -> str:
+    return getattr(settings, "CHANNEL_LAYER_BY_PREFIX", {}).get(group_prefix, default)
+
+
+def sync_payload(messages: list, more: bool, last_id: int) -> dict:
+    return {"type": "sync", "messages": messages, "more": more, "last_id": messages[-1]["id"] if messages else last_id}
+
+
+def sync_throttled_payload(last_id: int, retry_after: float) -> dict:
+    """An empty page that tells the client to ask for the same `last_id` again after `retry_after`."""
+    return {**sync_payload([], True, last_id), "retry_after": round(retry_after, 3)}
+
+
+class ChatConsumer(DrainMixin, CaptureMixin, ProfileMixin, OutboundMixin, AsyncWebsocketConsumer):
+    channel_layer_alias = layer_alias("chat_", "default")
+    outbound_kind = "chat"
 
-class ChatConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         self.user = self.scope["user"]
-        self.room_name = self.scope["url_route"]["kwargs"]["room_name"]
+        self.room_name = normalize_room_name(self.scope["url_route"]["kwargs"]["room_name"])
         self.room_group_name = f"chat_{self.room_name}"
 
-        if await self.room_exists(self.room_name):
-            await self.channel_layer.group_add(self.room_group_name, self.channel_name)
-            await self.accept()
-        else:
+        self.room_info = await self.get_room_info(self.room_name)
+        if self.room_info is None:
             await self.close(code=4004)
+        elif not await membership.ais_member(self.room_info.id, self.user.id):
+            await self.close(code=4003)
+        else:
+            await self.channel_layer.group_add(self.room_group_name, self.channel_name)
+            await self.accept_negotiated()
+            self.start_outbound()
+            self.throttle = FrameThrottle("chat", self.user.id or self.channel_name, self.room_name)
+            self.sync_throttle = FrameThrottle("sync", self.user.id or self.channel_name, self.room_name)
+            self.typing = TypingTracker(self.channel_layer, self.room_group_name, self.user.username, self.channel_name)
+            self.room_id = self.room_info.id
+            self._read_up_to = 0
+            self._sync_budget = SYNC_MAX
+            if self.room_info.batch_window_ms:
+                self.outbound.configure_batching(self.room_info.batch_window_ms, self.room_info.batch_max_size)
 
     async def disconnect(self, close_code):
         await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
+        if hasattr(self, "typing"):
+            await self.typing.stop()
+        await self.stop_outbound()
+
+    async def receive(self, text_data=None, bytes_data=None):
+        data = self.decode_frame(text_data, bytes_data)
+        if data is None:
+            return
+
+        if data.get("action") == "typing":
+            if self.user.is_authenticated:
+                await self.typing.ping(bool(data.get("active", True)))
+            return
+
+        if data.get("action") == "ack":
+            read = receipts.parse_ack_id(data.get("read"))
+            if self.user.is_authenticated and read > self._read_up_to:
+                self._read_up_to = read
+                receipts.buffer.ack_room(self.room_id, self.user.id, read)
+            return
+
+        if data.get("action") == "sync":
+            await self._catch_up(receipts.parse_ack_id(data.get("last_id")))
+            return
 
-    async def receive(self, text_data):
-        data = json.loads(text_data or "{}")
         content = (data.get("message") or "").strip()
-        room_name = data.get("room_name")
+        upload_id = attachments.parse_upload_id(data.get("attachment"))
 
         # ✅ Accept either key; use OR so reply_to works when reply_to_id is null
         raw_reply = data.get("reply_to_id") or data.get("reply_to")
@@ -40,83 +109,138 @@ class ChatConsumer(AsyncWebsocketConsumer):
         except (TypeError, ValueError):
             reply_to_id = None
 
-        if not content or not room_name:
+        if not content and not upload_id:
+            return
+
+        # Rate limit before any DB work
+        retry_after = await self.throttle.check()
+        if retry_after is not None:
+            await self.queue_payload(throttled_payload(retry_after))
             return
 
         # Do all ORM + decryption inside a sync thread and get a JSON-serializable dict
-        event = await self.create_message_and_event(
-            username=self.user.username,
+        # Always the room this socket joined, whatever room_name the client sends
+        event, bumped_at = await self.create_message_and_event(
             message=content,
-            room_name=room_name,
             reply_to_id=reply_to_id,
+            upload_id=upload_id,
         )
+        if event is None:
+            return
+        self.capture_stored(event["id"])
 
         await self.channel_layer.group_send(self.room_group_name, event)
+        await self.typing.stop()
+        if bumped_at is not None:
+            await inbox.notify_room(self.room_info, bumped_at, inbox_preview(event))
 
     async def chat_message(self, event):
-        await self.send(text_data=json.dumps(event))
+        await self.queue_payload(event, message_id=event.get("id"))
+
+    async def typing_update(self, event):
+        await self.queue_payload(event["payload"], coalesce_key="typing")
+
+    async def _catch_up(self, last_id: int):
+        """Messages after `last_id`, one bounded batch per request; the client asks again while `more`."""
+        if self._sync_budget <= 0:
+            await self.queue_payload({"type": "sync", "reset": True})
+            return
+        retry_after = await self.sync_throttle.check()
+        if retry_after is not None:
+            await self.queue_payload(sync_throttled_payload(last_id, retry_after))
+            return
+        events, more = await self.load_events_since(last_id, min(SYNC_BATCH, self._sync_budget))
+        self._sync_budget -= len(events)
+        await self.queue_payload(sync_payload(events, more, last_id))
 
     # ----------------- DB helpers -----------------
 
     @database_sync_to_async
-    def room_exists(self, room_name: str) -> bool:
-        return Room.objects.filter(name=room_name).exists()
+    def get_room_info(self, room_name: str) -> Optional[RoomInfo]:
+        return registry.resolve(room_name)
 
     @database_sync_to_async
-    def create_message_and_event(
-        self, *, username: str, message: str, room_name: str, reply_to_id: int | None
-    ) -> dict:
-        user = User.objects.filter(username=username).only("id", "username").first()
-        room = Room.objects.filter(name=room_name).only("id", "encryption_key").first()
-
-        # Save message; assign FK by id (no fetch needed)
-        msg = Message.objects.create(
-            sender=user,
-            message=message,          # if you encrypt on save, this will be ciphertext in DB
-            room=room,
-            reply_to_id=reply_to_id,
+    def load_events_since(self, last_id: int, limit: int) -> tuple:
+        # (room_id, id) index: a short range scan however big the room is
+        rows = list(
+            Message.objects.filter(room_id=self.room_id, id__gt=last_id)
+            .select_related("sender", "attachment")
+            .order_by("id")[:limit + 1]
         )
+        more = len(rows) > limit
+        rows = rows[:limit]
 
-        try:
-            decrypted_message = msg.get_decrypted_message()
-        except Exception:
-            decrypted_message = msg.message 
+        fernet = self.room_info.fernet()
+        for m in rows:
+            try:
+                m.message = fernet.decrypt(m.message.encode()).decode()
+            except Exception:
+                pass
+            previews.put(ROOM, m.pk, self.room_id, m.sender.username if m.sender_id else None, m.message)
+        replies = resolve_reply_previews(ROOM, self.room_id, [m.reply_to_id for m in rows if m.reply_to_id])
+        return [room_message_event(m, m.message, *replies.get(m.reply_to_id, (None, None))) for m in rows], more
 
-        # Resolve + decrypt reply preview if present
+    @database_sync_to_async
+    def create_message_and_event(self, *, message: str, reply_to_id: int | None, upload_id=None) -> tuple:
+        """(event for the room group, new inbox activity time or None); (None, None) if nothing was saved."""
+        user = self.user if self.user.is_authenticated else None
+        room = self.room_info.as_room()   # carries the key; no room query
+
+        with transaction.atomic():
+            claimed = attachments.claim_upload(upload_id, user.id, room.id) if upload_id and user else None
+            if not message and claimed is None:
+                return None, None
+
+            # Save message; assign FK by id (no fetch needed)
+            msg = Message.objects.create(
+                sender=user,
+                message=message,          # if you encrypt on save, this will be ciphertext in DB
+                room=room,
+                reply_to_id=reply_to_id,
+                attachment=claimed[0] if claimed else None,
+                attachment_name=claimed[1] if claimed else "",
+            )
+            now = datetime.now(timezone.utc)
+            bumped_at = now if inbox.bump_room(room.id, now) else None
+
+        decrypted_message = message   # we just encrypted it; no need to decrypt again
+        previews.put(ROOM, msg.pk, room.id, user.username if user else None, decrypted_message)
+
+        # Reply preview: usually a cache hit, otherwise one query + decrypt
         reply_username = None
         reply_preview = None
         if reply_to_id:
-            try:
-                reply_obj = (
-                    Message.objects.select_related("sender", "room")
-                    .only("id", "message", "sender__username", "room__encryption_key")
-                    .get(pk=reply_to_id)
-                )
-                reply_username = reply_obj.sender.username if reply_obj.sender_id else None
-                try:
-                    reply_preview = reply_obj.get_decrypted_message()[:140]
-                except Exception:
-                    reply_preview = (reply_obj.message or "")[:140]
-            except ObjectDoesNotExist:
-                reply_username = None
-                reply_preview = None
-
-        # Return primitives only
-        return {
-            "type": "chat_message",
-            "messageId": msg.pk,                   # UI uses camelCase
-            "id": msg.pk,                          # fallback for other clients
-            "username": user.username if user else "",
-            "message": decrypted_message,          # ✅ decrypted outbound text
-            "created_at": msg.created_at.isoformat(),
-            "reply_to": reply_to_id,
-            "reply_to_username": reply_username,
-            "reply_to_preview": reply_preview,     # ✅ decrypted preview when applicable
-        }
+            resolved = resolve_reply_previews(ROOM, room.id, [reply_to_id])
+            reply_username, reply_preview = resolved.get(reply_to_id, (None, None))
+
+        return room_message_event(msg, decrypted_message, reply_username, reply_preview), bumped_at
+
+
+def inbox_preview(payload: dict) -> str:
+    """Inbox line for a message payload: its text, else the attachment's file name."""
+    return payload.get("message") or "📎 " + ((payload.get("attachment") or {}).get("name") or "")
+
+
+def room_message_event(msg: Message, text: str, reply_username: Optional[str], reply_preview: Optional[str]) -> dict:
+    # Return primitives only
+    return {
+        "type": "chat_message",
+        "messageId": msg.pk,                   # UI uses camelCase
+        "id": msg.pk,                          # fallback for other clients
+        "username": msg.sender.username if msg.sender_id else "",
+        "message": text,                       # ✅ decrypted outbound text
+        "created_at": msg.created_at.isoformat(),
+        "reply_to": msg.reply_to_id,
+        "reply_to_username": reply_username,
+        "reply_to_preview": reply_preview,     # ✅ decrypted preview when applicable
+        "attachment": (
+            attachments.attachment_payload("room", msg.pk, msg.attachment, msg.attachment_name)
+            if msg.attachment_id else None
+        ),
+    }
 
 
 # ---------- Presence storage (Redis) ----------
-REDIS: Redis = Redis.from_url(getattr(settings, "PRESENCE_REDIS_URL", "redis://redis:6379/1"))
 
 ONLINE_TTL = 45        # seconds considered "online" without a heartbeat
 HEARTBEAT_EVERY = 15   # how often to refresh TTL and last_seen
@@ -175,6 +299,31 @@ async def _mark_offline(user_id: int, thread_uuid: str, conn_id: str):
         )
 
 
+async def _mark_offline_many(entries: list):
+    """_mark_offline for many (user_id, thread_uuid, conn_id) at once: one round trip (drain)."""
+    stamp = _now_iso()
+    async with REDIS.pipeline(transaction=False) as p:
+        for user_id, thread_uuid, conn_id in entries:
+            p.srem(_k_user(user_id), conn_id).srem(_k_thread(thread_uuid), conn_id).delete(_k_conn(conn_id))
+        for user_id in {user_id for user_id, _, _ in entries}:
+            p.set(_k_last_seen(user_id), stamp)
+        await p.execute()
+
+
+async def _remote_conns(thread_uuid: str, local: set) -> Set[str]:
+    """Live connections in this DM thread that aren't in `local` (i.e. on other workers)."""
+    conns = await REDIS.smembers(_k_thread(thread_uuid))
+    others = [c for c in ((c.decode() if isinstance(c, (bytes, bytearray)) else c) for c in conns) if c not in local]
+    if not others:
+        return set()
+    # members left behind by a crashed worker have no connection hash any more
+    pipe = REDIS.pipeline(transaction=False)
+    for c in others:
+        pipe.exists(_k_conn(c))
+    alive = await pipe.execute()
+    return {c for c, exists in zip(others, alive) if exists}
+
+
 async def _thread_online_user_ids(thread_uuid: str) -> Set[int]:
     """
     Return unique user_ids in this DM thread with any live connection.
@@ -206,11 +355,14 @@ async def _thread_online_user_ids(thread_uuid: str) -> Set[int]:
     return ids
 
 
-class DirectMessageConsumer(AsyncWebsocketConsumer):
+class DirectMessageConsumer(DrainMixin, LocalGroupMixin, CaptureMixin, ProfileMixin, OutboundMixin, AsyncWebsocketConsumer):
     """
     Endpoint for ws://.../ws/chat/<room_uuid>/
     where room_uuid is DirectThread.uuid
     """
+    # DMs live on their own channel layer so capacity/expiry can differ from rooms
+    channel_layer_alias = layer_alias("dm_", "dm")
+    outbound_kind = "dm"
 
     # --------------- Lifecycle ---------------
 
@@ -228,16 +380,29 @@ class DirectMessageConsumer(AsyncWebsocketConsumer):
 
         self.thread = thread
         self.group_name = f"dm_{self.room_name}"
-
-        await self.channel_layer.group_add(self.group_name, self.channel_name)
-        await self.accept()
+        # group events skip Redis for participants on this worker (chat/local_delivery.py)
+        self.group_sender = LocalFirstSender(self.channel_layer, "dm", partial(_remote_conns, self.room_name))
 
         # ---------- PRESENCE: mark online, start heartbeat, notify both sides ----------
         self.user_id: Optional[int] = getattr(self.user, "id", None)
         self.conn_id: str = self.channel_name
 
+        # online before joining the group, so a sender on another worker that
+        # can't see this connection yet can't have reached it through Redis either
         if self.user_id:
             await _mark_online(self.user_id, self.room_name, self.conn_id)
+
+        await self.join_group(self.group_name)
+        await self.accept_negotiated()
+        self.start_outbound()
+        self.throttle = FrameThrottle("dm", self.user.id, self.room_name)
+        self.sync_throttle = FrameThrottle("sync", self.user.id, self.room_name)
+        self.typing = TypingTracker(self.group_sender, self.group_name, self.user.username, self.channel_name)
+        self._receipt = [0, 0]            # this user's [delivered_up_to, read_up_to]
+        self._sync_budget = SYNC_MAX
+        self._receipt_fanout: Optional[asyncio.Task] = None
+
+        if self.user_id:
             self._hb_task = asyncio.create_task(self._heartbeat())
 
             # Send a presence snapshot to THIS socket
@@ -249,21 +414,31 @@ class DirectMessageConsumer(AsyncWebsocketConsumer):
     async def disconnect(self, close_code):
         try:
             if hasattr(self, "group_name"):
-                await self.channel_layer.group_discard(self.group_name, self.channel_name)
+                await self.leave_group(self.group_name)
         finally:
             # ---------- PRESENCE cleanup (TTL covers hard drops) ----------
-            if getattr(self, "user_id", None):
+            if getattr(self, "user_id", None) and not getattr(self, "_presence_released", False):
                 await _mark_offline(self.user_id, self.room_name, self.conn_id)
             if hasattr(self, "_hb_task"):
                 self._hb_task.cancel()
+            if hasattr(self, "typing"):
+                await self.typing.stop()
+            await self.stop_outbound()
             await self._broadcast_presence()
 
+    @classmethod
+    async def drain_batch(cls, consumers: list):
+        live = [c for c in consumers if getattr(c, "user_id", None)]
+        for c in live:
+            c._presence_released = True
+        if live:
+            await _mark_offline_many([(c.user_id, c.room_name, c.conn_id) for c in live])
+
     # --------------- Messages ---------------
 
     async def receive(self, text_data=None, bytes_data=None):
-        try:
-            data = json.loads(text_data or "{}")
-        except Exception:
+        data = self.decode_frame(text_data, bytes_data)
+        if data is None:
             return
 
         # Client can explicitly request a fresh presence snapshot
@@ -271,30 +446,90 @@ class DirectMessageConsumer(AsyncWebsocketConsumer):
             await self._send_presence_snapshot()
             return
 
+        if data.get("action") == "typing":
+            await self.typing.ping(bool(data.get("active", True)))
+            return
+
+        if data.get("action") == "ack":
+            await self._ack(receipts.parse_ack_id(data.get("delivered")), receipts.parse_ack_id(data.get("read")))
+            return
+
+        if data.get("action") == "sync":
+            await self._catch_up(receipts.parse_ack_id(data.get("last_id")))
+            return
+
         text = (data.get("message") or "").strip()
-        if not text:
+        upload_id = attachments.parse_upload_id(data.get("attachment"))
+        if not text and not upload_id:
             return
 
-        reply_to_id = data.get("reply_to")
-        msg = await self._create_message(text, reply_to_id)
-        if not msg:
+        retry_after = await self.throttle.check()
+        if retry_after is not None:
+            await self.queue_payload(throttled_payload(retry_after))
             return
 
-        payload = await self._message_to_payload(msg)
-        await self.channel_layer.group_send(
+        try:
+            reply_to_id = int(data["reply_to"]) if data.get("reply_to") is not None else None
+        except (TypeError, ValueError):
+            reply_to_id = None
+
+        payload = await self._create_message(text, reply_to_id, upload_id)
+        if not payload:
+            return
+        self.capture_stored(payload["id"])
+
+        await self.group_sender.group_send(
             self.group_name,
             {"type": "chat.message", "payload": payload},
         )
+        await self.typing.stop()
+        await inbox.notify_dm(self.thread, datetime.fromisoformat(payload["created_at"]), inbox_preview(payload))
 
     async def chat_message(self, event):
         # maps from type "chat.message"
-        await self.send(text_data=json.dumps(event["payload"]))
+        payload = event["payload"]
+        await self.queue_payload(payload, message_id=payload.get("id"))
+
+    async def typing_update(self, event):
+        await self.queue_payload(event["payload"], coalesce_key="typing")
+
+    async def receipt_update(self, event):
+        payload = event["payload"]
+        await self.queue_payload(payload, coalesce_key=f"receipt:{payload['user_id']}")
+
+    # --------------- Receipts ---------------
+
+    async def _ack(self, delivered: int, read: int):
+        """Record a watermark ack; the group hears about it at most once per fanout delay."""
+        delivered = max(delivered, read)
+        mine = self._receipt
+        if delivered <= mine[0] and read <= mine[1]:
+            return
+        mine[0], mine[1] = max(mine[0], delivered), max(mine[1], read)
+        receipts.buffer.ack_dm(self.thread.id, self.user_id, mine[0], mine[1])
+
+        if self._receipt_fanout is None or self._receipt_fanout.done():
+            self._receipt_fanout = asyncio.create_task(self._fanout_receipt())
+
+    async def _fanout_receipt(self):
+        await asyncio.sleep(receipts.RECEIPT_FANOUT_DELAY)
+        await self.group_sender.group_send(
+            self.group_name,
+            {"type": "receipt.update", "payload": {
+                "type": "receipt",
+                "thread": self.room_name,
+                "user_id": self.user_id,
+                "username": self.user.username,
+                "delivered_up_to": self._receipt[0],
+                "read_up_to": self._receipt[1],
+            }},
+        )
 
     # --------------- Presence events ---------------
 
     async def presence_update(self, event):
         # Push a normalized presence payload the client can consume
-        await self.send(text_data=json.dumps(event["payload"]))
+        await self.queue_payload(event["payload"], coalesce_key="presence")
 
     # --------------- Presence helpers ---------------
 
@@ -311,13 +546,13 @@ class DirectMessageConsumer(AsyncWebsocketConsumer):
         """Send presence only to this socket."""
         ids = await _thread_online_user_ids(self.room_name)
         payload = await self._presence_payload(ids)
-        await self.send(text_data=json.dumps(payload))
+        await self.queue_payload(payload, coalesce_key="presence")
 
     async def _broadcast_presence(self):
         """Notify both participants via the group."""
         ids = await _thread_online_user_ids(self.room_name)
         payload = await self._presence_payload(ids)
-        await self.channel_layer.group_send(
+        await self.group_sender.group_send(
             self.group_name,
             {"type": "presence.update", "payload": payload},
         )
@@ -376,19 +611,96 @@ class DirectMessageConsumer(AsyncWebsocketConsumer):
             return False
         return u.id in (thread.user_a_id, thread.user_b_id)
 
+    async def _catch_up(self, last_id: int):
+        """Messages after `last_id`, one bounded batch per request; the client asks again while `more`."""
+        if self._sync_budget <= 0:
+            await self.queue_payload({"type": "sync", "reset": True})
+            return
+        retry_after = await self.sync_throttle.check()
+        if retry_after is not None:
+            await self.queue_payload(sync_throttled_payload(last_id, retry_after))
+            return
+        payloads, more = await self._load_since(last_id, min(SYNC_BATCH, self._sync_budget))
+        self._sync_budget -= len(payloads)
+        await self.queue_payload(sync_payload(payloads, more, last_id))
+
     @database_sync_to_async
-    def _create_message(self, text: str, reply_to_id: Optional[int]):
-        u = getattr(self, "user", None)
-        if not u or not u.is_authenticated:
-            return None
-        thread = DirectThread.objects.only("id", "user_a_id", "user_b_id").get(uuid=self.room_name)
-        if u.id not in (thread.user_a_id, thread.user_b_id):
-            return None
-        reply_obj = None
-        if reply_to_id:
-            reply_obj = DirectMessage.objects.filter(id=reply_to_id, thread=thread).first()
-        return DirectMessage.objects.create(thread=thread, sender=u, message=text, reply_to=reply_obj)
+    def _load_since(self, last_id: int, limit: int) -> tuple:
+        # (thread_id, id) index: a short range scan however long the thread is
+        rows = list(
+            DirectMessage.objects.filter(thread_id=self.thread.id, id__gt=last_id)
+            .select_related("sender", "attachment")
+            .order_by("id")[:limit + 1]
+        )
+        more = len(rows) > limit
+        rows = rows[:limit]
+        for m in rows:
+            m.thread = self.thread
+            previews.put(DM, m.pk, self.thread.id, m.sender.username, m.message)
+        # one query for reply parents outside the batch; to_ws_payload then hits the cache
+        resolve_reply_previews(DM, self.thread.id, [m.reply_to_id for m in rows if m.reply_to_id])
+        return [m.to_ws_payload() for m in rows], more
 
     @database_sync_to_async
-    def _message_to_payload(self, msg: DirectMessage):
+    def _create_message(self, text: str, reply_to_id: Optional[int], upload_id=None) -> Optional[dict]:
+        """
+        Insert + thread bump in one statement and build the payload from what we
+        already hold: the thread and user checked on connect, the reply preview
+        cache. One thread hop, normally one query.
+        """
+        msg = DirectMessage.create_fast(self.thread, self.user, text, reply_to_id, upload_id)
+        if msg is None:
+            return None
+        previews.put(DM, msg.pk, self.thread.id, self.user.username, text)
         return msg.to_ws_payload()
+
+
+class InboxConsumer(DrainMixin, OutboundMixin, AsyncWebsocketConsumer):
+    """
+    Live updates for the homepage inbox (see chat/inbox.py). Server -> client
+    only: {"type": "inbox", "item": {...}} whenever a conversation moves up,
+    {"type": "inbox_removed", "key": ...} when the user is removed from a room.
+    """
+    channel_layer_alias = inbox.INBOX_LAYER
+    outbound_kind = "inbox"
+
+    async def connect(self):
+        self.user = self.scope.get("user")
+        if not self.user or not self.user.is_authenticated:
+            await self.close(code=4403)
+            return
+        room_ids = await database_sync_to_async(inbox.subscribed_room_ids)(self.user.id)
+        self._inbox_groups = {inbox.user_group(self.user.id), *(inbox.room_group(r) for r in room_ids)}
+        await asyncio.gather(*(self.channel_layer.group_add(g, self.channel_name) for g in self._inbox_groups))
+        await self.accept_negotiated()
+        self.start_outbound()
+
+    async def disconnect(self, close_code):
+        groups = getattr(self, "_inbox_groups", set())
+        await asyncio.gather(*(self.channel_layer.group_discard(g, self.channel_name) for g in groups))
+        await self.stop_outbound()
+
+    async def receive(self, text_data=None, bytes_data=None):
+        pass
+
+    async def inbox_update(self, event):
+        item = event["item"]
+        if item["kind"] == inbox.ROOM:
+            group = inbox.room_group(item["id"])
+            if event.get("joined"):
+                if group not in self._inbox_groups:
+                    self._inbox_groups.add(group)
+                    await self.channel_layer.group_add(group, self.channel_name)
+            elif group not in self._inbox_groups:
+                return   # published before we left the room, delivered after
+        # a burst on one conversation collapses to its newest state
+        await self.queue_payload({"type": "inbox", "item": item}, coalesce_key=item["key"])
+
+    async def inbox_left(self, event):
+        # removed from the room: no more of its previews, and drop it from the list
+        group = inbox.room_group(event["room_id"])
+        if group in self._inbox_groups:
+            self._inbox_groups.discard(group)
+            await self.channel_layer.group_discard(group, self.channel_name)
+        key = f"{inbox.ROOM}:{event['room_id']}"
+        await self.queue_payload({"type": "inbox_removed", "key": key}, coalesce_key=key)
@@ -0,0 +1,133 @@
+"""
+Graceful drain on SIGTERM, for rolling restarts.
+
+Without it every socket on a worker dies at once, presence keys linger
+until their TTL, and all clients come back in the same second. On SIGTERM
+this worker instead:
+
+  1. refuses new websocket handshakes;
+  2. sends every local socket `{"type": "reconnect", "after_ms": n}` with n
+     spread over DRAIN_RECONNECT_MS and closes it with 4012 (service
+     restart), so clients return gradually and catch up with `sync`, and
+     waits for the close handshakes;
+  3. marks all local DM connections offline in one Redis pipeline
+     (DirectMessageConsumer.drain_batch);
+  4. flushes buffered receipts, metrics and capture lines;
+
+then hands over to the previous SIGTERM handler (daphne/Twisted stops the
+reactor). DRAIN_TIMEOUT bounds the whole thing; a second SIGTERM skips it.
+"""
+import asyncio
+import random
+import signal
+import weakref
+from collections import defaultdict
+
+from django.conf import settings
+
+from . import capture, metrics, receipts
+
+DRAIN_TIMEOUT = getattr(settings, "DRAIN_TIMEOUT", 20)                       # seconds
+DRAIN_RECONNECT_MS = getattr(settings, "DRAIN_RECONNECT_MS", (1000, 15000))  # (min, max) hint
+DRAIN_CLOSE_WAIT = 5                                                         # seconds for close handshakes
+CLOSE_SERVICE_RESTART = 4012     # 1012 is "service restart", but daphne only sends 1000/3000-4999
+
+draining = False
+connections: "weakref.WeakSet" = weakref.WeakSet()
+_installed = False
+
+
+def reconnect_payload() -> dict:
+    return {"type": "reconnect", "after_ms": random.randint(*DRAIN_RECONNECT_MS)}
+
+
+def install():
+    """Hook SIGTERM on the running loop; once per process, from the first accepted socket."""
+    global _installed
+    if _installed:
+        return
+    _installed = True
+    loop = asyncio.get_running_loop()
+    previous = signal.getsignal(signal.SIGTERM)
+    try:
+        loop.add_signal_handler(signal.SIGTERM, _on_sigterm, loop, previous)
+    except (NotImplementedError, RuntimeError, ValueError):
+        pass   # not the main thread / no signal support: plain shutdown
+
+
+def _on_sigterm(loop, previous):
+    if draining:
+        _hand_over(loop, previous)   # second SIGTERM: stop waiting
+        return
+    loop.create_task(_drain_then_exit(loop, previous))
+
+
+async def _drain_then_exit(loop, previous):
+    try:
+        await asyncio.wait_for(drain(), DRAIN_TIMEOUT)
+    except Exception:
+        metrics.incr("drain.errors")
+    _hand_over(loop, previous)
+
+
+def _hand_over(loop, previous):
+    loop.remove_signal_handler(signal.SIGTERM)
+    if callable(previous):
+        previous(signal.SIGTERM, None)
+    elif previous != signal.SIG_IGN:
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.raise_signal(signal.SIGTERM)
+
+
+async def drain():
+    global draining
+    draining = True
+    local = list(connections)
+    metrics.incr("drain.connections", len(local))
+
+    by_class = defaultdict(list)
+    for consumer in local:
+        by_class[type(consumer)].append(consumer)
+    await asyncio.gather(
+        *(cls.drain_batch(batch) for cls, batch in by_class.items()),
+        *(consumer.drain_close() for consumer in local),
+        return_exceptions=True,
+    )
+
+    # let the close handshakes finish (disconnect() runs, outbound tasks stop)
+    # before the reactor goes away and cuts the TCP connections
+    deadline = asyncio.get_running_loop().time() + DRAIN_CLOSE_WAIT
+    while connections and asyncio.get_running_loop().time() < deadline:
+        await asyncio.sleep(0.05)
+
+    await asyncio.gather(receipts.buffer.flush(), metrics.flush(), return_exceptions=True)
+    if capture.writer is not None:
+        capture.writer.flush()
+
+
+class DrainMixin:
+    """Goes before OutboundMixin in the consumer bases."""
+
+    async def websocket_connect(self, message):
+        if draining:
+            await self.close()
+            return
+        await super().websocket_connect(message)
+
+    async def accept_negotiated(self):
+        await super().accept_negotiated()
+        connections.add(self)
+        install()
+
+    async def websocket_disconnect(self, message):
+        connections.discard(self)
+        await super().websocket_disconnect(message)
+
+    @classmethod
+    async def drain_batch(cls, consumers: list):
+        """Per-class cleanup done once for all local sockets of that class."""
+
+    async def drain_close(self):
+        # straight to the socket: the outbound queue may never get to it
+        await self.send_payload(reconnect_payload())
+        await self.close(code=CLOSE_SERVICE_RESTART)
@@ -0,0 +1,234 @@
+"""
+Unified inbox: the caller's rooms and DM threads in one list, newest activity first.
+
+Pages are keyset-paginated on (last_message_at, kind, id), so page N costs
+the same as page 1 however many conversations a user has:
+
+  * DM threads come from two ordered index scans, (user_a, -last_message_at,
+    -id) and (user_b, ...), each limited to one page;
+  * rooms come from a walk of the (-last_message_at, -id) room index that
+    keeps the rooms the user is a member of, also limited to one page.
+
+The cursor is an index bound, not a filter, so no source re-reads the
+rows of earlier pages, and only the 3 x (page + 1) rows fetched are
+merged in Python.
+
+Only the rows on the page get their last-message preview (one (room, id) /
+(thread, id) index probe each). After the first page the homepage listens
+on ws/inbox/ (InboxConsumer) for `inbox_update` events:
+
+  * DM messages are pushed to both participants' `inbox_u<user id>` groups;
+  * room activity goes to the room's `inbox_r<room id>` group, at most once
+    per ROOM_ACTIVITY_RESOLUTION seconds per room, so a busy room costs one
+    event per few seconds rather than one per message per member.
+"""
+from datetime import datetime, timedelta, timezone as dt_timezone
+from typing import List, Optional, Tuple
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db.models import Exists, OuterRef, Q, Subquery
+from django.urls import reverse
+
+from .models import DirectMessage, DirectThread, Message, Room, get_fernet
+from .membership import Membership
+from .previews import PREVIEW_LEN
+
+INBOX_PAGE_SIZE = getattr(settings, "INBOX_PAGE_SIZE", 30)
+INBOX_MAX_PAGE_SIZE = 100
+# Room.last_message_at is only rewritten when older than this (seconds)
+ROOM_ACTIVITY_RESOLUTION = getattr(settings, "ROOM_ACTIVITY_RESOLUTION", 5)
+# an inbox socket follows at most this many of the user's most active rooms
+INBOX_ROOM_SUBSCRIPTIONS = getattr(settings, "INBOX_ROOM_SUBSCRIPTIONS", 500)
+INBOX_LAYER = getattr(settings, "CHANNEL_LAYER_BY_PREFIX", {}).get("inbox_", "default")
+
+ROOM, DM = "room", "dm"
+_RANK = {DM: 0, ROOM: 1}      # tie-break between kinds at the same timestamp
+_EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def user_group(user_id: int) -> str:
+    return f"inbox_u{user_id}"
+
+
+def room_group(room_id: int) -> str:
+    return f"inbox_r{room_id}"
+
+
+# ---------- Cursors ----------
+
+def _micros(ts: datetime) -> int:
+    return (ts - _EPOCH) // timedelta(microseconds=1)
+
+
+def encode_cursor(ts: datetime, kind: str, obj_id: int) -> str:
+    return f"{_micros(ts)}.{_RANK[kind]}.{obj_id}"
+
+
+def parse_cursor(value: Optional[str]) -> Optional[Tuple[datetime, int, int]]:
+    try:
+        micros, rank, obj_id = (int(part) for part in (value or "").split("."))
+    except ValueError:
+        return None
+    if rank not in _RANK.values():
+        return None
+    return _EPOCH + timedelta(microseconds=micros), rank, obj_id
+
+
+def _after(queryset, kind: str, cursor):
+    """Rows of `kind` that sort after the cursor in (last_message_at, kind, id) DESC order."""
+    if cursor is None:
+        return queryset
+    ts, rank, obj_id = cursor
+    if _RANK[kind] < rank:
+        return queryset.filter(last_message_at__lte=ts)
+    if _RANK[kind] > rank:
+        return queryset.filter(last_message_at__lt=ts)
+    # the redundant `lte` is what Postgres can use as an index bound; the OR alone is a filter
+    return queryset.filter(last_message_at__lte=ts).filter(Q(last_message_at__lt=ts) | Q(id__lt=obj_id))
+
+
+# ---------- Items ----------
+
+def room_item(room, last_message_at: datetime, preview: Optional[str]) -> dict:
+    return {
+        "key": f"{ROOM}:{room.id}",
+        "kind": ROOM,
+        "id": room.id,
+        "title": room.name,
+        "url": f"/chat/{room.slug}/",
+        "last_message_at": last_message_at.isoformat(),
+        "preview": preview,
+    }
+
+
+def dm_item(thread, other_username: str, last_message_at: datetime, preview: Optional[str]) -> dict:
+    return {
+        "key": f"{DM}:{thread.id}",
+        "kind": DM,
+        "id": thread.id,
+        "title": other_username,
+        "url": reverse("dm_room", kwargs={"room_name": str(thread.uuid)}),
+        "last_message_at": last_message_at.isoformat(),
+        "preview": preview,
+    }
+
+
+def _decrypt_preview(room, token: Optional[str]) -> Optional[str]:
+    if token is None:
+        return None
+    try:
+        return get_fernet(room.encryption_key, room.previous_keys).decrypt(token.encode()).decode()[:PREVIEW_LEN]
+    except Exception:
+        return None
+
+
+def page(user, cursor=None, limit: int = INBOX_PAGE_SIZE) -> Tuple[List[dict], Optional[str]]:
+    """One page of the inbox and the cursor for the next one (None at the end)."""
+    limit = max(1, min(limit, INBOX_MAX_PAGE_SIZE))
+    # each source fetches one extra row so "is there a next page" needs no COUNT
+    fetch = limit + 1
+
+    room_preview = Message.objects.filter(room_id=OuterRef("pk")).order_by("-id").values("message")[:1]
+    member = Membership.objects.filter(room_id=OuterRef("pk"), user_id=user.pk)
+    rooms = list(
+        _after(Room.objects.filter(Exists(member)), ROOM, cursor)
+        .only("id", "name", "slug", "encryption_key", "previous_keys", "last_message_at")
+        .annotate(last_message=Subquery(room_preview))
+        .order_by("-last_message_at", "-id")[:fetch]
+    )
+
+    dm_preview = DirectMessage.objects.filter(thread_id=OuterRef("pk")).order_by("-id").values("message")[:1]
+    threads = []
+    for mine, other in (("user_a", "user_b"), ("user_b", "user_a")):
+        threads += [
+            (thread, getattr(thread, other).username)
+            for thread in _after(DirectThread.objects.filter(**{mine: user}), DM, cursor)
+            .select_related(other)
+            .only("id", "uuid", "last_message_at", f"{other}__username")
+            .annotate(last_message=Subquery(dm_preview))
+            .order_by("-last_message_at", "-id")[:fetch]
+        ]
+
+    rows = [((r.last_message_at, _RANK[ROOM], r.id), ROOM, r) for r in rooms]
+    rows += [((t.last_message_at, _RANK[DM], t.id), DM, (t, name)) for t, name in threads]
+    rows.sort(key=lambda row: row[0], reverse=True)
+    more = len(rows) > limit
+    rows = rows[:limit]
+
+    items = []
+    for _, kind, obj in rows:
+        if kind == ROOM:
+            items.append(room_item(obj, obj.last_message_at, _decrypt_preview(obj, obj.last_message)))
+        else:
+            thread, name = obj
+            items.append(dm_item(thread, name, thread.last_message_at, (thread.last_message or "")[:PREVIEW_LEN] or None))
+
+    next_cursor = None
+    if more and rows:
+        (ts, _, obj_id), kind, _ = rows[-1]
+        next_cursor = encode_cursor(ts, kind, obj_id)
+    return items, next_cursor
+
+
+def subscribed_room_ids(user_id: int) -> List[int]:
+    return list(
+        Room.objects.filter(granted_users=user_id)
+        .order_by("-last_message_at")
+        .values_list("id", flat=True)[:INBOX_ROOM_SUBSCRIPTIONS]
+    )
+
+
+# ---------- Push ----------
+
+def bump_room(room_id: int, when: datetime) -> bool:
+    """Move the room's activity forward if it is more than a resolution step behind."""
+    return bool(
+        Room.objects.filter(pk=room_id, last_message_at__lt=when - timedelta(seconds=ROOM_ACTIVITY_RESOLUTION))
+        .update(last_message_at=when)
+    )
+
+
+def _event(item: dict, joined: bool = False) -> dict:
+    return {"type": "inbox_update", "item": item, "joined": joined}
+
+
+async def notify_room(room, when: datetime, preview: Optional[str]):
+    """`room` is a RoomInfo or Room; `when` is the activity time bump_room just wrote."""
+    await get_channel_layer(INBOX_LAYER).group_send(room_group(room.id), _event(room_item(room, when, preview)))
+
+
+async def notify_dm(thread, when: datetime, preview: Optional[str]):
+    """Both participants see the thread move up; `thread` has user_a/user_b loaded."""
+    layer = get_channel_layer(INBOX_LAYER)
+    for user, other in ((thread.user_a, thread.user_b), (thread.user_b, thread.user_a)):
+        await layer.group_send(user_group(user.id), _event(dm_item(thread, other.username, when, preview)))
+
+
+def notify_joined(room_ids, user_ids):
+    """Sync (signals): tell the users' inbox sockets about rooms they were just added to."""
+    layer = get_channel_layer(INBOX_LAYER)
+    if layer is None:
+        return
+    try:
+        for room in Room.objects.filter(pk__in=room_ids).only("id", "name", "slug", "last_message_at"):
+            for user_id in user_ids:
+                async_to_sync(layer.group_send)(
+                    user_group(user_id), _event(room_item(room, room.last_message_at, None), joined=True)
+                )
+    except Exception:
+        pass   # best effort; the room shows up on the next homepage load anyway
+
+
+def notify_left(room_ids, user_ids):
+    """Sync (signals): make the users' inbox sockets stop following rooms they were removed from."""
+    layer = get_channel_layer(INBOX_LAYER)
+    if layer is None:
+        return
+    try:
+        for room_id in room_ids:
+            for user_id in user_ids:
+                async_to_sync(layer.group_send)(user_group(user_id), {"type": "inbox_left", "room_id": room_id})
+    except Exception:
+        pass   # best effort; a reconnect subscribes from the DB again
@@ -0,0 +1,107 @@
+"""
+In-process delivery for group members that live on this worker.
+
+With sticky routing both sides of a DM usually sit on the same daphne
+process, yet every event still went to Redis and back. Consumers register
+their groups in `local_groups`; a LocalFirstSender then:
+
+  * hands the event straight to every local member's handler;
+  * asks `remote_members` which live members are on other workers, and only
+    if there are any (or it can't tell) does a layer group_send, tagged with
+    this process's ORIGIN so local members drop the Redis copy
+    (LocalGroupMixin).
+
+Every event a consumer sends to a group goes through its sender (messages,
+receipts, presence and typing), so each member still sees one sender's
+events in the order they were sent, whichever path they took. Counters:
+ws.<kind>.local_deliveries / remote_deliveries / layer_skipped; `manage.py
+ws_metrics` prints the local hit ratio.
+"""
+import uuid
+from collections import defaultdict
+from typing import Awaitable, Callable, Optional
+
+from channels.consumer import get_handler_name
+
+from . import metrics
+
+ORIGIN = uuid.uuid4().hex   # this process
+
+
+class LocalGroups:
+    """group -> {channel_name: consumer}, for this process only. Touched from the event loop only."""
+
+    def __init__(self):
+        self._groups = defaultdict(dict)
+
+    def add(self, group: str, consumer):
+        self._groups[group][consumer.channel_name] = consumer
+
+    def discard(self, group: str, consumer):
+        members = self._groups.get(group)
+        if members is not None:
+            members.pop(consumer.channel_name, None)
+            if not members:
+                del self._groups[group]
+
+    def members(self, group: str) -> dict:
+        return dict(self._groups.get(group, ()))
+
+
+local_groups = LocalGroups()
+
+
+class LocalFirstSender:
+    """
+    Drop-in for `channel_layer.group_send` (TypingTracker takes one).
+    `remote_members(local_channel_names)` returns the live channel names of
+    members on other workers; None means "unknown", which falls back to the layer.
+    """
+
+    def __init__(self, channel_layer, kind: str, remote_members: Callable[[set], Awaitable[Optional[set]]]):
+        self.channel_layer = channel_layer
+        self.kind = kind
+        self.remote_members = remote_members
+
+    async def group_send(self, group: str, event: dict):
+        local = local_groups.members(group)
+        try:
+            remote = await self.remote_members(set(local))
+        except Exception:
+            remote = None   # Redis trouble: let the layer sort it out
+
+        handler_name = get_handler_name(event)
+        for consumer in local.values():
+            try:
+                # the handler itself: dispatch() would add a DB-thread hop per member
+                await getattr(consumer, handler_name)(event)
+            except Exception:
+                metrics.incr(f"ws.{self.kind}.local_errors")
+        metrics.incr(f"ws.{self.kind}.local_deliveries", len(local))
+
+        if remote is not None and not remote:
+            metrics.incr(f"ws.{self.kind}.layer_skipped")
+            return
+        await self.channel_layer.group_send(group, {**event, "origin": ORIGIN})
+        metrics.incr(f"ws.{self.kind}.remote_deliveries", len(remote) if remote is not None else 1)
+
+
+class LocalGroupMixin:
+    """
+    Goes before OutboundMixin in the consumer bases. Call `join_group` /
+    `leave_group` instead of group_add / group_discard.
+    """
+
+    async def join_group(self, group: str):
+        # register first: from here on the Redis copy of a local send is dropped
+        local_groups.add(group, self)
+        await self.channel_layer.group_add(group, self.channel_name)
+
+    async def leave_group(self, group: str):
+        local_groups.discard(group, self)
+        await self.channel_layer.group_discard(group, self.channel_name)
+
+    async def dispatch(self, message):
+        if message.get("origin") == ORIGIN:
+            return   # already handed over in-process by the sender
+        await super().dispatch(message)
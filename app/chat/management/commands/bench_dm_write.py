@@ -0,0 +1,79 @@
+import time
+import uuid
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from chat.models import DirectMessage, DirectThread
+from chat.previews import previews, DM
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the DirectMessage write path used by the DM consumer: the old "
+        "ORM path (re-fetch thread, save() with full_clean, lazy payload) against "
+        "DirectMessage.create_fast. Runs inside a transaction that is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--messages", type=int, default=500)
+        parser.add_argument("--reply-every", type=int, default=4, help="Every Nth message replies to the previous one.")
+
+    def handle(self, *args, **options):
+        n = options["messages"]
+        reply_every = options["reply_every"]
+
+        with transaction.atomic():
+            suffix = uuid.uuid4().hex[:8]
+            a = User.objects.create(username=f"bench_a_{suffix}")
+            b = User.objects.create(username=f"bench_b_{suffix}")
+            thread = DirectThread.get_or_create_for_users(a, b)
+
+            results = [
+                ("orm (old)", self._run(n, reply_every, lambda text, reply_id: self._orm_path(thread, a, text, reply_id))),
+                ("create_fast", self._run(n, reply_every, lambda text, reply_id: self._fast_path(thread, a, text, reply_id))),
+            ]
+            transaction.set_rollback(True)
+
+        self.stdout.write(f"{n} messages, every {reply_every}th is a reply\n")
+        self.stdout.write(f"{'path':<14}{'total ms':>10}{'us/msg':>10}{'queries/msg':>13}")
+        for name, (elapsed, queries) in results:
+            self.stdout.write(f"{name:<14}{elapsed * 1000:>10.1f}{elapsed / n * 1e6:>10.0f}{queries / n:>13.2f}")
+
+    def _run(self, n, reply_every, write):
+        previews.clear()
+        last_id = None
+        with CaptureQueriesContext(connection) as ctx:
+            started = time.perf_counter()
+            for i in range(n):
+                reply_id = last_id if reply_every and i % reply_every == 0 else None
+                last_id = write(f"bench message {i}", reply_id)
+            elapsed = time.perf_counter() - started
+        return elapsed, len(ctx.captured_queries)
+
+    def _orm_path(self, thread, sender, text, reply_id):
+        # what DirectMessageConsumer did before create_fast
+        thread = DirectThread.objects.only("id", "user_a_id", "user_b_id").get(uuid=thread.uuid)
+        reply_obj = DirectMessage.objects.filter(id=reply_id, thread=thread).first() if reply_id else None
+        msg = DirectMessage.objects.create(thread=thread, sender=sender, message=text, reply_to=reply_obj)
+        payload = {
+            "id": msg.id,
+            "room_name": str(msg.thread.uuid),
+            "username": msg.sender.username,
+            "message": msg.message,
+            "created_at": msg.created_at.isoformat(),
+        }
+        if msg.reply_to_id:
+            payload["reply_to_message"] = msg.reply_to.message
+            payload["reply_to_username"] = msg.reply_to.sender.username
+        return msg.id
+
+    def _fast_path(self, thread, sender, text, reply_id):
+        msg = DirectMessage.create_fast(thread, sender, text, reply_id)
+        previews.put(DM, msg.pk, thread.id, sender.username, text)
+        msg.to_ws_payload()
+        return msg.id
@@ -0,0 +1,93 @@
+import asyncio
+import time
+import uuid
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.module_loading import import_string
+from redis import Redis, ResponseError
+
+
+def _redis_for(config):
+    host = config.get("hosts", ["redis://localhost:6379"])[0]
+    if isinstance(host, dict):
+        return Redis.from_url(host["address"]) if "address" in host else Redis(**host)
+    return Redis.from_url(host)
+
+
+def _redis_stats(client):
+    try:
+        info = client.info()
+    except ResponseError:   # INFO disabled/renamed (some managed Redis)
+        return None
+    return (
+        int(info.get("total_commands_processed", 0)),
+        float(info.get("used_cpu_user", 0.0)) + float(info.get("used_cpu_sys", 0.0)),
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark room fanout on the configured channel layers: one group with N "
+        "member channels, M group_sends, then every member drains its messages. "
+        "Reports wall time plus Redis commands and CPU (from INFO, so run it against "
+        "an otherwise idle Redis). Uses a throwaway prefix and flushes it afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--members", type=int, nargs="+", default=[10, 1000, 10000])
+        parser.add_argument("--messages", type=int, default=10)
+        parser.add_argument("--layers", nargs="+", default=["default", "pubsub"], help="CHANNEL_LAYERS aliases to compare.")
+
+    def handle(self, *args, **options):
+        for alias in options["layers"]:
+            if alias not in settings.CHANNEL_LAYERS:
+                raise CommandError(f"unknown channel layer alias {alias!r}")
+
+        self.stdout.write(
+            f"{'layer':<10}{'members':>9}{'send ms/msg':>13}{'drain ms/msg':>14}"
+            f"{'redis cmds/msg':>16}{'redis cpu ms/msg':>18}"
+        )
+        for members in options["members"]:
+            for alias in options["layers"]:
+                send, drain, cmds, cpu = asyncio.run(self._run(alias, members, options["messages"]))
+                redis_cols = f"{cmds:>16.1f}{cpu * 1000:>18.2f}" if cmds is not None else f"{'n/a':>16}{'n/a':>18}"
+                self.stdout.write(f"{alias:<10}{members:>9}{send * 1000:>13.2f}{drain * 1000:>14.2f}{redis_cols}")
+
+    async def _run(self, alias, members, messages):
+        config = settings.CHANNEL_LAYERS[alias]
+        layer = import_string(config["BACKEND"])(
+            **{**config.get("CONFIG", {}), "prefix": f"bench_fanout_{uuid.uuid4().hex[:8]}"}
+        )
+        client = _redis_for(config.get("CONFIG", {}))
+        group = "chat_bench"
+        try:
+            channels = [await layer.new_channel() for _ in range(members)]
+            for channel in channels:
+                await layer.group_add(group, channel)
+            event = {"type": "chat_message", "id": 0, "username": "bench", "message": "x" * 120}
+
+            # warm up connections / scripts outside the measured window
+            await layer.group_send(group, event)
+            for channel in channels:
+                await layer.receive(channel)
+
+            before = _redis_stats(client)
+            started = time.perf_counter()
+            for i in range(messages):
+                await layer.group_send(group, {**event, "id": i + 1})
+            sent = time.perf_counter()
+            for channel in channels:
+                for _ in range(messages):
+                    await layer.receive(channel)
+            drained = time.perf_counter()
+            after = _redis_stats(client)
+        finally:
+            await layer.flush()
+            client.close()
+
+        cmds = cpu = None
+        if before and after:
+            cmds = (after[0] - before[0]) / messages
+            cpu = (after[1] - before[1]) / messages
+        return (sent - started) / messages, (drained - sent) / messages, cmds, cpu
@@ -0,0 +1,31 @@
+import os
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from chat.attachments import part_path, store_part
+from chat.models import Upload
+
+
+class Command(BaseCommand):
+    help = "Delete uploads that were abandoned (never finished or never sent) and their partial files."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--older-than", type=int, default=24, help="Age in hours (default 24).")
+
+    def handle(self, *args, **options):
+        stale = Upload.objects.filter(created_at__lt=timezone.now() - timedelta(hours=options["older_than"]))
+        removed = 0
+        for upload_id, sha256 in stale.values_list("id", "attachment__sha256").iterator():
+            if sha256:
+                # finished, but the process died before the post-commit move
+                store_part(part_path(upload_id), sha256)
+            else:
+                try:
+                    os.remove(part_path(upload_id))
+                except FileNotFoundError:
+                    pass
+            removed += 1
+        stale.delete()
+        self.stdout.write(self.style.SUCCESS(f"pruned {removed} uploads"))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from chat import membership
+
+
+class Command(BaseCommand):
+    help = "Rebuild the Redis room membership sets from Room.granted_users."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--room", type=int, action="append", dest="rooms", help="Only this room id (repeatable).")
+
+    def handle(self, *args, **options):
+        written = membership.rebuild(options["rooms"])
+        self.stdout.write(self.style.SUCCESS(f"rebuilt membership for {written} rooms"))
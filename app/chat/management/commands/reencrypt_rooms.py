@@ -0,0 +1,145 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+
+from cryptography.fernet import Fernet, InvalidToken, MultiFernet
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from chat.models import Message, Room
+from chat.registry import ROOM_REGISTRY_LOCAL_TTL
+
+
+def _reencrypt(keys, rows):
+    """
+    Runs in a pool worker. Returns ([(id, token)], skipped) for the rows that
+    still need the primary key; plain Python + cryptography only, no Django.
+    """
+    primary = Fernet(keys[0].encode())
+    multi = MultiFernet([Fernet(k.encode()) for k in keys])
+    changed, skipped = [], 0
+    for message_id, token in rows:
+        raw = token.encode()
+        try:
+            primary.decrypt(raw)
+            continue   # written after the rotation
+        except InvalidToken:
+            pass
+        try:
+            changed.append((message_id, multi.rotate(raw).decode()))
+        except InvalidToken:
+            skipped += 1   # not readable with any known key; leave it alone
+    return changed, skipped
+
+
+def _write(room_id, changed, cursor):
+    """One UPDATE ... FROM (VALUES ...) for the batch, plus the cursor, in one transaction."""
+    table = Message._meta.db_table
+    with transaction.atomic():
+        if changed:
+            with connection.cursor() as cur:
+                cur.execute(
+                    f"UPDATE {table} AS m SET message = v.message "
+                    f"FROM (VALUES {', '.join(['(%s, %s)'] * len(changed))}) AS v(id, message) "
+                    f"WHERE m.id = v.id",
+                    [x for row in changed for x in row],
+                )
+        Room.objects.filter(pk=room_id).update(reencrypt_cursor=cursor)
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-encrypt room messages with the room's current key after a rotation. "
+        "Walks messages in id order in batches, decrypts/encrypts on a process pool "
+        "and writes each batch with one UPDATE. Resumable: progress is stored in "
+        "Room.reencrypt_cursor, so an interrupted run continues where it stopped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--room", type=int, action="append", dest="rooms", help="Room id (repeatable). Default: every room with pending work.")
+        parser.add_argument("--rotate", action="store_true", help="Generate a new key for the selected rooms first.")
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+
+    def handle(self, *args, **options):
+        rooms = Room.objects.order_by("id")
+        if options["rooms"]:
+            rooms = rooms.filter(pk__in=options["rooms"])
+        elif options["rotate"]:
+            raise CommandError("--rotate needs at least one --room")
+        else:
+            rooms = rooms.filter(reencrypt_cursor__isnull=False)
+
+        rooms = list(rooms)
+        if options["rotate"]:
+            for room in rooms:
+                room.rotate_key()
+                self.stdout.write(f"room {room.pk}: rotated key")
+
+        with ProcessPoolExecutor(max_workers=options["workers"]) as pool:
+            for room in rooms:
+                if room.reencrypt_cursor is None:
+                    self.stdout.write(f"room {room.pk}: nothing to re-encrypt")
+                    continue
+                self._run_room(pool, room, options["batch_size"], options["workers"])
+
+    def _run_room(self, pool, room, batch_size, workers):
+        keys = (room.encryption_key, *[k for k in room.previous_keys.split(",") if k])
+        cursor = room.reencrypt_cursor
+        scan_started = timezone.now()
+        total = Message.objects.filter(room_id=room.pk, id__gt=cursor).count()
+        done = changed_total = skipped_total = 0
+        started = time.perf_counter()
+        self.stdout.write(f"room {room.pk}: {total} messages after id {cursor}, {len(keys) - 1} old key(s)")
+
+        rows = self._fetch(room.pk, cursor, batch_size)
+        while rows:
+            # split across workers; fetch the next batch while they crunch
+            step = -(-len(rows) // workers)
+            futures = [pool.submit(_reencrypt, keys, rows[i:i + step]) for i in range(0, len(rows), step)]
+            last_id = rows[-1][0]
+            next_rows = self._fetch(room.pk, last_id, batch_size)
+
+            changed = []
+            for future in futures:
+                batch_changed, skipped = future.result()
+                changed.extend(batch_changed)
+                skipped_total += skipped
+            _write(room.pk, changed, last_id)
+
+            done += len(rows)
+            changed_total += len(changed)
+            elapsed = time.perf_counter() - started
+            self.stdout.write(
+                f"  {done}/{total} ({done / max(total, 1):.0%})  "
+                f"{done / elapsed:,.0f} msg/s  cursor={last_id}"
+            )
+            rows = next_rows
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"room {room.pk}: {done} scanned, {changed_total} re-encrypted, "
+            f"{skipped_total} unreadable, {elapsed:.1f}s"
+        )
+
+        # Other workers keep encrypting with the old key until their registry
+        # entry expires, so only retire old keys if this scan started after that.
+        if room.key_rotated_at and scan_started < room.key_rotated_at + timedelta(seconds=ROOM_REGISTRY_LOCAL_TTL * 2):
+            self.stdout.write(self.style.WARNING(
+                f"room {room.pk}: rotated less than {ROOM_REGISTRY_LOCAL_TTL * 2}s before this run; "
+                f"old keys kept, rerun later to retire them"
+            ))
+            return
+        room.previous_keys = ""
+        room.reencrypt_cursor = None
+        room.save(update_fields=["previous_keys", "reencrypt_cursor"])   # post_save refreshes the registry
+        self.stdout.write(self.style.SUCCESS(f"room {room.pk}: old keys retired"))
+
+    def _fetch(self, room_id, after_id, limit):
+        return list(
+            Message.objects.filter(room_id=room_id, id__gt=after_id)
+            .order_by("id")
+            .values_list("id", "message")[:limit]
+        )
@@ -0,0 +1,345 @@
+import json
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from importlib import import_module
+from urllib.parse import urlsplit
+
+import msgpack
+import websocket
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY, get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.wire import MSGPACK_SUBPROTOCOL
+
+User = get_user_model()
+
+PATHS = {"chat": "/ws/chat/{}/", "dm": "/ws/person/{}/"}
+MARKER = re.compile(r"\[replay ([0-9a-f]+):(\d+)\]")
+
+
+def load_sessions(paths):
+    """Capture files -> {conn: {"open", "frames", "stored", "close"}}, connections without an open dropped."""
+    sessions = defaultdict(lambda: {"open": None, "frames": [], "stored": {}, "close": None})
+    for path in paths:
+        with open(path) as fh:
+            for line in fh:
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    continue   # torn last line of a killed worker
+                s = sessions[rec["conn"]]
+                if rec["ev"] == "open":
+                    s["open"] = rec
+                elif rec["ev"] == "frame":
+                    s["frames"].append(rec)
+                elif rec["ev"] == "stored":
+                    s["stored"][rec["seq"]] = rec["id"]
+                elif rec["ev"] == "close":
+                    s["close"] = rec
+    return {conn: s for conn, s in sessions.items() if s["open"] is not None}
+
+
+def percentiles(values):
+    if not values:
+        return None
+    values = sorted(values)
+    pick = lambda q: values[min(len(values) - 1, int(q * len(values)))]
+    return {"n": len(values), "p50": pick(0.5), "p90": pick(0.9), "p99": pick(0.99), "max": values[-1]}
+
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latency = defaultdict(list)     # "connect" / "message" / "sync" -> [ms]
+        self.errors = Counter()
+        self.closes = Counter()              # server-initiated close codes
+
+    def add_latency(self, kind, ms):
+        with self.lock:
+            self.latency[kind].append(ms)
+
+    def error(self, name, n=1):
+        with self.lock:
+            self.errors[name] += n
+
+
+class IdMap:
+    """Recorded message id -> id the replay created for it, shared by all connections."""
+
+    def __init__(self, recorded_ids):
+        self.recorded = set(recorded_ids)
+        self._ids = {}
+        self._changed = threading.Condition()
+
+    def put(self, recorded_id, new_id):
+        with self._changed:
+            self._ids[recorded_id] = new_id
+            self._changed.notify_all()
+
+    def get(self, recorded_id, timeout):
+        """
+        Waits (up to `timeout`) for messages created earlier in the capture, so
+        reply chains survive --speed; older messages can't be mapped at all.
+        """
+        if recorded_id not in self.recorded:
+            return None
+        with self._changed:
+            self._changed.wait_for(lambda: recorded_id in self._ids, timeout)
+            return self._ids.get(recorded_id)
+
+
+class Replayer:
+    """Plays one recorded connection: sends on the caller's thread, reads on another."""
+
+    def __init__(self, conn, session, base_url, origin, cookie, speed, timeout, stats, id_map):
+        self.conn = conn
+        self.session = session
+        self.url = base_url + PATHS[session["open"]["kind"]].format(session["open"]["target"])
+        self.origin = origin
+        self.cookie = cookie
+        self.speed = speed
+        self.timeout = timeout
+        self.stats = stats
+        self.id_map = id_map
+        self.tag = conn[:8]
+        self.pending = {}                    # seq -> sent at (perf_counter)
+        self.sync_sent = None
+        self.closed = threading.Event()      # set by the reader once the socket is done
+        self.leaving = False                 # we started the close handshake
+        self.binary = MSGPACK_SUBPROTOCOL in (session["open"].get("proto") or ())
+
+    def run(self, t0, started):
+        s = self.session
+        self._sleep_until(started, s["open"]["t"] - t0)
+        connect_at = time.perf_counter()
+        try:
+            ws = websocket.create_connection(
+                self.url, cookie=self.cookie, origin=self.origin, timeout=self.timeout,
+                subprotocols=[MSGPACK_SUBPROTOCOL] if self.binary else None,
+            )
+        except websocket.WebSocketBadStatusException as e:
+            self.stats.error(f"handshake_{e.status_code}")
+            return
+        except (OSError, websocket.WebSocketException):
+            self.stats.error("connect_failed")
+            return
+        self.stats.add_latency("connect", (time.perf_counter() - connect_at) * 1000)
+        ws.settimeout(None)
+        reader = threading.Thread(target=self._read, args=(ws,), daemon=True)
+        reader.start()
+
+        try:
+            for frame in s["frames"]:
+                self._sleep_until(started, frame["t"] - t0)
+                if self.closed.is_set():
+                    break
+                ws.send(*self._encode(self._frame_data(frame)))
+            if s["close"]:
+                self._sleep_until(started, s["close"]["t"] - t0)
+            # give outstanding echoes the timeout, then leave the way the client did
+            deadline = time.perf_counter() + self.timeout
+            while (self.pending or self.sync_sent) and not self.closed.is_set() and time.perf_counter() < deadline:
+                time.sleep(0.01)
+            if not self.closed.is_set():
+                self.leaving = True
+                code = (s["close"] or {}).get("code")
+                ws.close(status=code if code in (1000, 1001) else websocket.STATUS_NORMAL)
+        except (OSError, websocket.WebSocketException):
+            self.stats.error("socket_error")
+        finally:
+            reader.join(self.timeout)
+            if self.pending:
+                self.stats.error("no_echo", len(self.pending))
+
+    def _sleep_until(self, started, offset):
+        delay = started + offset / self.speed - time.perf_counter()
+        if delay > 0:
+            self.closed.wait(delay)
+
+    def _read(self, ws):
+        try:
+            while True:
+                opcode, data = ws.recv_data(control_frame=True)
+                if opcode == websocket.ABNF.OPCODE_CLOSE:
+                    if not self.leaving and len(data) >= 2:
+                        with self.stats.lock:
+                            self.stats.closes[int.from_bytes(data[:2], "big")] += 1
+                    return
+                if opcode not in (websocket.ABNF.OPCODE_TEXT, websocket.ABNF.OPCODE_BINARY):
+                    continue
+                try:
+                    payload = msgpack.unpackb(data, raw=False) if opcode == websocket.ABNF.OPCODE_BINARY else json.loads(data)
+                except (ValueError, msgpack.UnpackException):
+                    self.stats.error("bad_frame")
+                    continue
+                for item in payload if isinstance(payload, list) else [payload]:
+                    if isinstance(item, dict):
+                        self._handle(item)
+        except (OSError, websocket.WebSocketException):
+            pass   # we closed it, or the server went away (counted via pending)
+        finally:
+            self.closed.set()
+
+    def _handle(self, item):
+        if item.get("type") == "error":
+            self.stats.error(item.get("code") or "error")
+        if item.get("type") == "sync" and self.sync_sent is not None:
+            self.stats.add_latency("sync", (time.perf_counter() - self.sync_sent) * 1000)
+            self.sync_sent = None
+        match = MARKER.search(item.get("message") or "")
+        if match and match.group(1) == self.tag:
+            seq = int(match.group(2))
+            sent = self.pending.pop(seq, None)
+            if sent is not None:
+                self.stats.add_latency("message", (time.perf_counter() - sent) * 1000)
+                recorded_id = self.session["stored"].get(seq)
+                if recorded_id is not None and item.get("id") is not None:
+                    self.id_map.put(recorded_id, item["id"])
+
+    def _frame_data(self, frame) -> dict:
+        data = {k: v for k, v in frame["data"].items() if k not in ("message_len", "attachment")}
+        for key in ("reply_to", "reply_to_id"):
+            if data.get(key) is not None:
+                mapped = self.id_map.get(data[key], self.timeout)
+                if mapped is None:
+                    self.stats.error("reply_unmapped")
+                    data.pop(key)
+                else:
+                    data[key] = mapped
+        if "message_len" in frame["data"] or frame["data"].get("attachment"):
+            # same length as the original; uploads are not replayed, so attachments become text
+            marker = f"[replay {self.tag}:{frame['seq']}]"
+            data["message"] = marker + "x" * max(frame["data"].get("message_len", 0) - len(marker), 0)
+            self.pending[frame["seq"]] = time.perf_counter()
+        if data.get("action") == "sync":
+            self.sync_sent = time.perf_counter()
+        return data
+
+    def _encode(self, data):
+        if self.binary:
+            return msgpack.packb(data, use_bin_type=True), websocket.ABNF.OPCODE_BINARY
+        return json.dumps(data), websocket.ABNF.OPCODE_TEXT
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay websocket sessions recorded with WS_CAPTURE_PATH against a running "
+        "server, at the recorded pace or faster (--speed). Logs the recorded users in "
+        "by creating sessions in this project's database, so point it at a copy of the "
+        "captured deployment. Reports connect/echo/sync latency and errors, and with "
+        "--baseline the change against an earlier --out report. Note the per-user "
+        "rate limits (WS_RATE_LIMITS) still apply at --speed > 1."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("captures", nargs="+", help="NDJSON capture files.")
+        parser.add_argument("--url", default="ws://localhost:8000", help="Base websocket URL of the server.")
+        parser.add_argument("--speed", type=float, default=1.0, help="Time compression, e.g. 10 plays 10x faster.")
+        parser.add_argument("--timeout", type=float, default=5.0, help="Seconds to wait for connects and echoes.")
+        parser.add_argument("--max-connections", type=int, default=None, help="Replay only the first N connections.")
+        parser.add_argument("--out", help="Write the report as JSON.")
+        parser.add_argument("--baseline", help="Earlier --out report to diff against.")
+
+    def handle(self, *args, **options):
+        if options["speed"] <= 0:
+            raise CommandError("--speed must be positive")
+        sessions = load_sessions(options["captures"])
+        if not sessions:
+            raise CommandError("no recorded connections in the capture")
+        ordered = sorted(sessions.items(), key=lambda item: item[1]["open"]["t"])[:options["max_connections"]]
+        t0 = ordered[0][1]["open"]["t"]
+
+        stats = Stats()
+        cookies, session_keys = self._login({s["open"]["user"] for _, s in ordered})
+        parts = urlsplit(options["url"])
+        origin = f"{'https' if parts.scheme == 'wss' else 'http'}://{parts.netloc}"
+        base_url = options["url"].rstrip("/")
+        id_map = IdMap(i for _, session in ordered for i in session["stored"].values())
+
+        threads = []
+        started = time.perf_counter() + 0.5
+        try:
+            for conn, session in ordered:
+                cookie = cookies.get(session["open"]["user"])
+                if cookie is None:
+                    stats.error("unknown_user")
+                    continue
+                replayer = Replayer(conn, session, base_url, origin, cookie, options["speed"], options["timeout"], stats, id_map)
+                thread = threading.Thread(target=replayer.run, args=(t0, started), daemon=True)
+                thread.start()
+                threads.append(thread)
+            for thread in threads:
+                thread.join()
+        finally:
+            store = import_module(settings.SESSION_ENGINE).SessionStore()
+            for key in session_keys:
+                store.delete(key)
+        elapsed = time.perf_counter() - started
+
+        captured_closes = Counter(s["close"]["code"] for _, s in ordered if s["close"])
+        report = {
+            "connections": len(ordered),
+            "frames": sum(len(s["frames"]) for _, s in ordered),
+            "speed": options["speed"],
+            "seconds": round(elapsed, 2),
+            "latency_ms": {kind: percentiles(values) for kind, values in stats.latency.items()},
+            "errors": dict(stats.errors),
+            "server_closes": {str(code): n for code, n in stats.closes.items()},
+            "captured_closes": {str(code): n for code, n in captured_closes.items()},
+        }
+        baseline = None
+        if options["baseline"]:
+            with open(options["baseline"]) as fh:
+                baseline = json.load(fh)
+        self._print(report, baseline)
+        if options["out"]:
+            with open(options["out"], "w") as fh:
+                json.dump(report, fh, indent=2)
+
+    def _login(self, user_ids):
+        """Session cookies for the recorded users that exist here."""
+        store_class = import_module(settings.SESSION_ENGINE).SessionStore
+        backend = settings.AUTHENTICATION_BACKENDS[0]
+        cookies, keys = {}, []
+        for user in User.objects.filter(pk__in=[u for u in user_ids if u is not None]):
+            store = store_class()
+            store[SESSION_KEY] = user._meta.pk.value_to_string(user)
+            store[BACKEND_SESSION_KEY] = backend
+            store[HASH_SESSION_KEY] = user.get_session_auth_hash()
+            store.create()
+            cookies[user.pk] = f"{settings.SESSION_COOKIE_NAME}={store.session_key}"
+            keys.append(store.session_key)
+        return cookies, keys
+
+    def _print(self, report, baseline):
+        self.stdout.write(
+            f"{report['connections']} connections, {report['frames']} frames in {report['seconds']}s "
+            f"at {report['speed']}x"
+        )
+        self.stdout.write(f"{'latency ms':<12}{'n':>8}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}{'Δp50':>10}{'Δp99':>10}")
+        for kind, row in sorted(report["latency_ms"].items()):
+            if not row:
+                continue
+            before = ((baseline or {}).get("latency_ms") or {}).get(kind)
+            delta = (
+                f"{row['p50'] - before['p50']:>+10.1f}{row['p99'] - before['p99']:>+10.1f}" if before else f"{'':>20}"
+            )
+            self.stdout.write(
+                f"{kind:<12}{row['n']:>8}{row['p50']:>10.1f}{row['p90']:>10.1f}{row['p99']:>10.1f}{row['max']:>10.1f}{delta}"
+            )
+        before_errors = (baseline or {}).get("errors", {})
+        names = sorted(set(report["errors"]) | set(before_errors))
+        if names:
+            self.stdout.write(f"{'errors':<20}{'count':>8}{'Δ' if baseline else '':>8}")
+            for name in names:
+                n = report["errors"].get(name, 0)
+                delta = f"{n - before_errors.get(name, 0):>+8}" if baseline else ""
+                self.stdout.write(f"{name:<20}{n:>8}{delta}")
+        codes = sorted(set(report["server_closes"]) | set(report["captured_closes"]))
+        if codes:
+            self.stdout.write(f"{'close code':<20}{'replay':>8}{'captured':>10}")
+            for code in codes:
+                self.stdout.write(f"{code:<20}{report['server_closes'].get(code, 0):>8}{report['captured_closes'].get(code, 0):>10}")
@@ -0,0 +1,34 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from redis import Redis
+
+from chat.metrics import METRICS_KEY
+
+
+class Command(BaseCommand):
+    help = "Print the websocket counters aggregated from all workers."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--prefix", default="", help="Only show counters starting with this prefix.")
+        parser.add_argument("--reset", action="store_true", help="Clear all counters after printing.")
+
+    def handle(self, *args, **options):
+        client = Redis.from_url(getattr(settings, "PRESENCE_REDIS_URL", "redis://redis:6379/1"))
+        raw = client.hgetall(METRICS_KEY)
+        counters = {k.decode(): int(v) for k, v in raw.items()}
+
+        for name in sorted(counters):
+            if name.startswith(options["prefix"]):
+                self.stdout.write(f"{name:<48} {counters[name]}")
+
+        # share of group deliveries that stayed in-process (chat/local_delivery.py)
+        for name in sorted(counters):
+            if name.endswith(".local_deliveries") and name.startswith(options["prefix"]):
+                base = name[:-len(".local_deliveries")]
+                local, remote = counters[name], counters.get(f"{base}.remote_deliveries", 0)
+                if local + remote:
+                    self.stdout.write(f"{base + '.local_hit_ratio':<48} {local / (local + remote):.1%}")
+
+        if options["reset"]:
+            client.delete(METRICS_KEY)
+            self.stdout.write(self.style.WARNING("counters reset"))
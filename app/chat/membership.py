@@ -0,0 +1,179 @@
+"""
+Room membership mirrored into Redis sets.
+
+    room:members:{room_id}   SET of user ids granted access to the room
+    room:members:built       SET of room ids whose member set is complete
+    room:members:ver:{room_id}  bumped by every add/remove/forget; also stamps
+                                the room-mate cache in chat/user_search.py
+
+Room.granted_users stays the source of truth. The m2m_changed handlers in
+chat/signals.py apply each change after commit and `manage.py
+rebuild_room_members` recreates everything. A room missing from the built
+set (fresh Redis, flushed db) is answered from Postgres once and rebuilt on
+the spot; if Redis is down every check falls back to Postgres. A rebuild
+only writes a set if its version didn't move between the Postgres read and
+the write, so a change applied meanwhile can't be overwritten with stale
+members.
+"""
+from typing import Iterable, List, Optional, Set
+
+from channels.db import database_sync_to_async
+from redis.exceptions import RedisError, WatchError
+
+from . import metrics
+from .models import Room
+from .redis_client import REDIS, REDIS_SYNC
+
+Membership = Room.granted_users.through
+
+K_BUILT = "room:members:built"
+REBUILD_CHUNK = 500
+REBUILD_ATTEMPTS = 3
+
+
+def _k_members(room_id: int) -> str:
+    return f"room:members:{room_id}"
+
+
+def _k_version(room_id: int) -> str:
+    return f"room:members:ver:{room_id}"
+
+
+def _db_is_member(room_id: int, user_id: int) -> bool:
+    return Membership.objects.filter(room_id=room_id, user_id=user_id).exists()
+
+
+def rebuild(room_ids: Optional[Iterable[int]] = None) -> int:
+    """(Re)write the member sets of `room_ids` (all rooms if None). Returns rooms written."""
+    if room_ids is None:
+        room_ids = Room.objects.order_by("id").values_list("id", flat=True)
+        REDIS_SYNC.delete(K_BUILT)
+    room_ids = list(room_ids)
+
+    written = 0
+    for i in range(0, len(room_ids), REBUILD_CHUNK):
+        chunk = room_ids[i:i + REBUILD_CHUNK]
+        for _ in range(REBUILD_ATTEMPTS):
+            if _rebuild_chunk(chunk):
+                written += len(chunk)
+                break
+        else:
+            # kept changing under us; leave it unbuilt so checks use Postgres
+            metrics.incr("membership.rebuild_conflicts")
+            REDIS_SYNC.srem(K_BUILT, *chunk)
+    return written
+
+
+def _rebuild_chunk(chunk: list) -> bool:
+    """Rewrite the sets of `chunk`; False if an add/remove/forget raced the read."""
+    version_keys = [_k_version(room_id) for room_id in chunk]
+    versions = REDIS_SYNC.mget(version_keys)   # before the read, so anything applied after it is seen
+
+    members = {room_id: [] for room_id in chunk}
+    for room_id, user_id in Membership.objects.filter(room_id__in=chunk).values_list("room_id", "user_id"):
+        members[room_id].append(user_id)
+
+    with REDIS_SYNC.pipeline(transaction=True) as p:
+        try:
+            p.watch(*version_keys)
+            if p.mget(version_keys) != versions:
+                return False
+            p.multi()
+            for room_id, user_ids in members.items():
+                p.delete(_k_members(room_id))
+                if user_ids:
+                    p.sadd(_k_members(room_id), *user_ids)
+            p.sadd(K_BUILT, *chunk)
+            p.execute()
+        except WatchError:
+            return False
+    return True
+
+
+def is_member(room_id: int, user_id: Optional[int]) -> bool:
+    """Sync membership check for views."""
+    if not user_id:
+        return False
+    try:
+        with REDIS_SYNC.pipeline(transaction=False) as p:
+            p.sismember(_k_members(room_id), user_id)
+            p.sismember(K_BUILT, room_id)
+            member, built = p.execute()
+    except RedisError:
+        metrics.incr("membership.redis_errors")
+        return _db_is_member(room_id, user_id)
+
+    if built:
+        return bool(member)
+    metrics.incr("membership.rebuilds")
+    member = _db_is_member(room_id, user_id)
+    try:
+        rebuild([room_id])
+    except RedisError:
+        metrics.incr("membership.redis_errors")
+    return member
+
+
+async def ais_member(room_id: int, user_id: Optional[int]) -> bool:
+    """Async membership check for consumers; no DB query when the set is built."""
+    if not user_id:
+        return False
+    try:
+        async with REDIS.pipeline(transaction=False) as p:
+            p.sismember(_k_members(room_id), user_id)
+            p.sismember(K_BUILT, room_id)
+            member, built = await p.execute()
+    except RedisError:
+        metrics.incr("membership.redis_errors")
+        return await database_sync_to_async(_db_is_member)(room_id, user_id)
+
+    if built:
+        return bool(member)
+    return await database_sync_to_async(is_member)(room_id, user_id)
+
+
+def versions(room_ids: List[int]) -> Optional[list]:
+    """The rooms' current versions, for callers caching something derived from their members; None if Redis is down."""
+    try:
+        return REDIS_SYNC.mget([_k_version(room_id) for room_id in room_ids])
+    except RedisError:
+        metrics.incr("membership.redis_errors")
+        return None
+
+
+def add(room_ids: Set[int], user_ids: Set[int]):
+    _apply("sadd", room_ids, user_ids)
+
+
+def remove(room_ids: Set[int], user_ids: Set[int]):
+    _apply("srem", room_ids, user_ids)
+
+
+def forget(room_ids: Set[int]):
+    """Drop the sets entirely; the next check rebuilds them from Postgres."""
+    if not room_ids:
+        return
+    try:
+        with REDIS_SYNC.pipeline(transaction=True) as p:
+            p.srem(K_BUILT, *room_ids)
+            for room_id in room_ids:
+                p.delete(_k_members(room_id))
+                p.incr(_k_version(room_id))
+            p.execute()
+    except RedisError:
+        metrics.incr("membership.redis_errors")
+
+
+def _apply(op: str, room_ids: Set[int], user_ids: Set[int]):
+    if not room_ids or not user_ids:
+        return
+    try:
+        with REDIS_SYNC.pipeline(transaction=True) as p:
+            for room_id in room_ids:
+                getattr(p, op)(_k_members(room_id), *user_ids)
+                p.incr(_k_version(room_id))
+            p.execute()
+    except RedisError:
+        # can't tell what made it; drop the sets so checks go back to Postgres
+        metrics.incr("membership.redis_errors")
+        forget(room_ids)
@@ -0,0 +1,65 @@
+"""
+Process-local counters for the websocket hot paths.
+
+Counting happens in memory (no I/O on the hot path); a background task
+flushes the deltas into one Redis hash every few seconds so
+`manage.py ws_metrics` can read totals across all workers.
+"""
+import asyncio
+from collections import Counter
+from typing import Dict
+
+from django.conf import settings
+
+from .redis_client import REDIS
+
+METRICS_KEY = "metrics:ws"                                   # HASH { counter_name: total }
+FLUSH_EVERY = getattr(settings, "WS_METRICS_FLUSH_EVERY", 10)  # seconds
+
+_pending: Counter = Counter()   # not yet written to Redis
+_totals: Counter = Counter()    # since this process started
+_flusher: "asyncio.Task | None" = None
+
+
+def incr(name: str, amount: int = 1) -> None:
+    """Bump a counter. Safe to call from sync code; flushing starts on the first async call."""
+    _pending[name] += amount
+    _totals[name] += amount
+    _ensure_flusher()
+
+
+def snapshot() -> Dict[str, int]:
+    """Counters of this process only."""
+    return dict(_totals)
+
+
+async def flush() -> None:
+    """Push pending deltas to Redis. On failure they are kept for the next round."""
+    if not _pending:
+        return
+    batch = dict(_pending)
+    _pending.clear()
+    try:
+        async with REDIS.pipeline(transaction=False) as p:
+            for name, amount in batch.items():
+                p.hincrby(METRICS_KEY, name, amount)
+            await p.execute()
+    except Exception:
+        _pending.update(batch)
+
+
+def _ensure_flusher() -> None:
+    global _flusher
+    if _flusher is not None and not _flusher.done():
+        return
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return  # worker thread (database_sync_to_async); the next async incr starts it
+    _flusher = loop.create_task(_flush_forever())
+
+
+async def _flush_forever():
+    while True:
+        await asyncio.sleep(FLUSH_EVERY)
+        await flush()
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 04:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0004_message_created_at_message_reply_to_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='room',
+            name='batch_max_size',
+            field=models.PositiveSmallIntegerField(default=50),
+        ),
+        migrations.AddField(
+            model_name='room',
+            name='batch_window_ms',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,43 @@
+from django.db import migrations, models
+from slugify import slugify
+
+
+def fill_slugs(apps, schema_editor):
+    """
+    Give every room a normalized slug. Rooms whose names normalize to the same
+    slug (e.g. "Lobby" and "lobby") keep their rows and messages; the oldest
+    one owns the plain slug and the others get "<slug>-<id>" (plus "-<n>" if
+    another room is literally named that).
+    """
+    Room = apps.get_model("chat", "Room")
+    taken = set()
+    for room in Room.objects.order_by("id").only("id", "name").iterator():
+        base = slugify(text=room.name or "", max_length=120) or f"room-{room.pk}"
+        slug, n = base, 0
+        # a suffixed or fallback slug can still be some other room's name
+        while slug in taken:
+            slug = f"{base[:100]}-{room.pk}" + (f"-{n}" if n else "")
+            n += 1
+        taken.add(slug)
+        Room.objects.filter(pk=room.pk).update(slug=slug)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0006_receipts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='room',
+            name='slug',
+            field=models.SlugField(db_index=False, editable=False, max_length=120, null=True),
+        ),
+        migrations.RunPython(fill_slugs, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='room',
+            name='slug',
+            field=models.SlugField(editable=False, max_length=120, unique=True),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-19 04:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0007_room_slug'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='room',
+            name='key_rotated_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='room',
+            name='previous_keys',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.AddField(
+            model_name='room',
+            name='reencrypt_cursor',
+            field=models.BigIntegerField(blank=True, editable=False, null=True),
+        ),
+    ]
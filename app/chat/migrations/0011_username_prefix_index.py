@@ -0,0 +1,40 @@
+from django.conf import settings
+from django.db import migrations
+
+INDEX = "chat_user_username_prefix_idx"
+
+
+def _table(apps):
+    return apps.get_model(settings.AUTH_USER_MODEL)._meta.db_table
+
+
+def create_index(apps, schema_editor):
+    # Matches what username__istartswith compiles to on Postgres,
+    # UPPER("username"::text) LIKE UPPER('ab%'). The "C" collation makes the
+    # prefix a range scan that also serves ORDER BY ... COLLATE "C" + LIMIT.
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute(
+        f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {INDEX} '
+        f'ON {schema_editor.quote_name(_table(apps))} (UPPER("username"::text) COLLATE "C")'
+    )
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {INDEX}")
+
+
+class Migration(migrations.Migration):
+    # CONCURRENTLY can't run inside a transaction; auth_user stays writable meanwhile
+    atomic = False
+
+    dependencies = [
+        ('chat', '0010_message_sync_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
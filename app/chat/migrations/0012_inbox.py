@@ -0,0 +1,50 @@
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+from django.db.models.functions import Coalesce, Now
+
+
+def fill_activity(apps, schema_editor):
+    """Rooms: time of their newest message (else now). Threads: creation time if they never had one."""
+    Room = apps.get_model("chat", "Room")
+    Message = apps.get_model("chat", "Message")
+    DirectThread = apps.get_model("chat", "DirectThread")
+    newest = Message.objects.filter(room_id=OuterRef("pk")).order_by("-id").values("created_at")[:1]
+    Room.objects.update(last_message_at=Coalesce(Subquery(newest), Now()))
+    DirectThread.objects.filter(last_message_at__isnull=True).update(last_message_at=models.F("created_at"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0011_username_prefix_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='room',
+            name='last_message_at',
+            field=models.DateTimeField(db_index=True, editable=False, null=True),
+        ),
+        migrations.RunPython(fill_activity, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='room',
+            name='last_message_at',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.AlterField(
+            model_name='directthread',
+            name='last_message_at',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now),
+        ),
+        migrations.AddIndex(
+            model_name='directthread',
+            index=models.Index(fields=['user_a', '-last_message_at', '-id'], name='chat_dm_inbox_a_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='directthread',
+            index=models.Index(fields=['user_b', '-last_message_at', '-id'], name='chat_dm_inbox_b_idx'),
+        ),
+    ]
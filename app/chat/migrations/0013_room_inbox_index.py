@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-19 06:00
+
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0012_inbox'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='room',
+            index=models.Index(fields=['-last_message_at', '-id'], name='chat_room_inbox_idx'),
+        ),
+        migrations.AlterField(
+            model_name='room',
+            name='last_message_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
@@ -1,45 +1,126 @@
 from django.db import models
 from django.contrib.auth.models import User
-from cryptography.fernet import Fernet
+from cryptography.fernet import Fernet, MultiFernet
+from functools import lru_cache
 from datetime import datetime
 from django.utils import timezone
 import uuid
-from django.db import transaction
+from typing import Optional
+from django.db import connection, transaction
+from slugify import slugify
 
 
 def generate_key():
     return Fernet.generate_key().decode()
 
 
+@lru_cache(maxsize=1024)
+def get_fernet(key: str, previous_keys: str = "") -> MultiFernet:
+    """
+    Encrypts with `key`, decrypts with `key` or any of the comma-separated
+    `previous_keys`. Cached: building Fernet objects per message adds up.
+    """
+    keys = [key] + [k for k in previous_keys.split(",") if k]
+    return MultiFernet([Fernet(k.encode()) for k in keys])
+
+
+def normalize_room_name(name: str) -> str:
+    """The canonical, case-insensitive form of a room name used for lookups."""
+    return slugify(text=name or "", max_length=120)
+
+
 class Room(models.Model):
     name = models.CharField(max_length=120, null=True, blank=False)
+    # normalized name; every lookup by name goes through this unique index
+    slug = models.SlugField(max_length=120, unique=True, editable=False)
     creator = models.ForeignKey(User, blank=False, null=True, on_delete=models.CASCADE, related_name="room_creator")
     granted_users = models.ManyToManyField(User, blank=True)
     encryption_key = models.CharField(max_length=44, blank=False, default=generate_key)
+    # Key rotation: old keys stay readable (newest first, comma-separated) until
+    # `manage.py reencrypt_rooms` has moved every message to `encryption_key`.
+    previous_keys = models.TextField(blank=True, default="", editable=False)
+    key_rotated_at = models.DateTimeField(null=True, blank=True, editable=False)
+    # last message id re-encrypted; None = nothing pending
+    reencrypt_cursor = models.BigIntegerField(null=True, blank=True, editable=False)
+    # Opt-in frame coalescing for busy rooms: each socket gathers events for up
+    # to `batch_window_ms` and sends them as one JSON array frame. 0 = off.
+    batch_window_ms = models.PositiveSmallIntegerField(default=0)
+    batch_max_size = models.PositiveSmallIntegerField(default=50)
+    # inbox ordering; bumped by the consumer at most every ROOM_ACTIVITY_RESOLUTION
+    last_message_at = models.DateTimeField(default=timezone.now, editable=False)
+
+    class Meta:
+        indexes = [
+            # inbox keyset pages and subscribed_room_ids walk this in order
+            models.Index(fields=["-last_message_at", "-id"], name="chat_room_inbox_idx"),
+        ]
 
     def __str__(self):
         return self.name
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        room = super().from_db(db, field_names, values)
+        room._loaded_name = room.__dict__.get("name")
+        return room
+
+    def save(self, *args, **kwargs):
+        # Follow renames (the registry signal also drops the old slug). Only on
+        # a real rename: migration 0007 gave clashing names "<slug>-<id>".
+        loaded = getattr(self, "_loaded_name", None)
+        if not self.slug or (loaded is not None and self.name != loaded):
+            slug = normalize_room_name(self.name)
+            if self.slug and slug != self.slug:
+                self._renamed_from = self.slug
+            self.slug = slug
+            update_fields = kwargs.get("update_fields")
+            if update_fields is not None and "slug" not in update_fields:
+                kwargs["update_fields"] = [*update_fields, "slug"]
+        result = super().save(*args, **kwargs)
+        self._loaded_name = self.name
+        return result
+
+    def fernet(self) -> MultiFernet:
+        return get_fernet(self.encryption_key, self.previous_keys)
+
+    def rotate_key(self):
+        """Switch new writes to a fresh key; existing messages are re-encrypted by reencrypt_rooms."""
+        with transaction.atomic():
+            room = Room.objects.select_for_update().get(pk=self.pk)
+            room.previous_keys = ",".join(k for k in [room.encryption_key] + room.previous_keys.split(",") if k)
+            room.encryption_key = generate_key()
+            room.key_rotated_at = timezone.now()
+            room.reencrypt_cursor = 0
+            room.save(update_fields=["encryption_key", "previous_keys", "key_rotated_at", "reencrypt_cursor"])
+        self.encryption_key = room.encryption_key
+        self.previous_keys = room.previous_keys
+        self.key_rotated_at = room.key_rotated_at
+        self.reencrypt_cursor = room.reencrypt_cursor
+
 class Message(models.Model):
     reply_to = models.ForeignKey('self', null=True, on_delete=models.SET_NULL, related_name='replies')
     sender = models.ForeignKey(User, blank=False, null=True, on_delete=models.CASCADE, related_name="message_sender")
     room = models.ForeignKey(Room, blank=False, null=True, on_delete=models.CASCADE)
     message = models.TextField()
     created_at = models.DateTimeField(default=datetime.now)
+    attachment = models.ForeignKey("Attachment", null=True, blank=True, on_delete=models.SET_NULL, related_name="+")
+    attachment_name = models.CharField(max_length=255, blank=True, default="")
+
+    class Meta:
+        # reconnect sync reads "room X, id > N" in id order
+        indexes = [models.Index(fields=["room", "id"], name="chat_message_room_id_idx")]
 
     def __str__(self):
         return f"{self.room.name} | {self.sender.username}"
     
     def save(self, *args, **kwargs):
         if self.room.encryption_key:
-            fernet = Fernet(self.room.encryption_key.encode())
-            self.message = fernet.encrypt(self.message.encode()).decode()
+            self.message = self.room.fernet().encrypt(self.message.encode()).decode()
         return super().save(*args, **kwargs)
 
     def get_decrypted_message(self):
         if self.room.encryption_key:
-            fernet = Fernet(self.room.encryption_key.encode())
-            return fernet.decrypt(self.message.encode()).decode()
+            return self.room.fernet().decrypt(self.message.encode()).decode()
         return self.message
 
 
@@ -52,9 +133,15 @@ class DirectThread(models.Model):
 
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
-    last_message_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    # creation time until the first message; the inbox sorts by it
+    last_message_at = models.DateTimeField(default=timezone.now, db_index=True)
 
     class Meta:
+        # inbox: "my threads, most recent first" is an ordered scan per side
+        indexes = [
+            models.Index(fields=["user_a", "-last_message_at", "-id"], name="chat_dm_inbox_a_idx"),
+            models.Index(fields=["user_b", "-last_message_at", "-id"], name="chat_dm_inbox_b_idx"),
+        ]
         constraints = [
             models.UniqueConstraint(fields=["user_a", "user_b"], name="unique_dm_pair_ordered"),
             models.CheckConstraint(check=~models.Q(user_a=models.F("user_b")), name="dm_distinct_users"),
@@ -86,10 +173,15 @@ class DirectMessage(models.Model):
     message = models.TextField()
     reply_to = models.ForeignKey("self", null=True, blank=True, on_delete=models.SET_NULL, related_name="replies")
     created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    attachment = models.ForeignKey("Attachment", null=True, blank=True, on_delete=models.SET_NULL, related_name="+")
+    attachment_name = models.CharField(max_length=255, blank=True, default="")
 
     class Meta:
         ordering = ["created_at", "id"]
-        indexes = [models.Index(fields=["thread", "created_at"])]
+        indexes = [
+            models.Index(fields=["thread", "created_at"]),
+            models.Index(fields=["thread", "id"], name="chat_dm_thread_id_idx"),
+        ]
 
     def clean(self):
         if self.reply_to and self.reply_to.thread_id != self.thread_id:
@@ -102,6 +194,63 @@ class DirectMessage(models.Model):
             super().save(*args, **kwargs)
             DirectThread.objects.filter(pk=self.thread_id).update(last_message_at=timezone.now())
 
+    @classmethod
+    def create_fast(
+        cls, thread: DirectThread, sender, text: str, reply_to_id: Optional[int] = None, upload_id=None
+    ) -> Optional["DirectMessage"]:
+        """
+        Websocket write path: inserts the message and bumps thread.last_message_at
+        in one statement (data-modifying CTE), skipping full_clean().
+
+        The caller must already have checked that `sender` is a participant of
+        `thread` (DirectMessageConsumer does on connect). A reply_to outside the
+        thread is dropped to NULL by the query itself. `upload_id` (a finished
+        Upload of `sender` for this thread) is consumed by the same statement;
+        anything else is ignored. Returns None if the thread has been deleted
+        in the meantime, or if there is neither text nor a valid upload.
+        """
+        now = timezone.now()
+        table = cls._meta.db_table
+        sql = f"""
+            WITH bump AS (
+                UPDATE {DirectThread._meta.db_table} SET last_message_at = %s
+                WHERE id = %s RETURNING id
+            ),
+            claim AS (
+                DELETE FROM {Upload._meta.db_table}
+                WHERE id = %s AND user_id = %s AND thread_id = %s AND attachment_id IS NOT NULL
+                RETURNING attachment_id, filename
+            ),
+            ins AS (
+                INSERT INTO {table} (thread_id, sender_id, message, reply_to_id, created_at, attachment_id, attachment_name)
+                SELECT bump.id, %s, %s,
+                       (SELECT r.id FROM {table} r WHERE r.id = %s AND r.thread_id = bump.id),
+                       %s,
+                       (SELECT attachment_id FROM claim),
+                       COALESCE((SELECT filename FROM claim), '')
+                FROM bump
+                WHERE %s <> '' OR EXISTS (SELECT 1 FROM claim)
+                RETURNING id, reply_to_id, attachment_id, attachment_name
+            )
+            SELECT ins.id, ins.reply_to_id, ins.attachment_name, a.id, a.sha256, a.size, a.content_type, a.has_thumbnail
+            FROM ins LEFT JOIN {Attachment._meta.db_table} a ON a.id = ins.attachment_id
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [now, thread.pk, upload_id.hex if upload_id else None, sender.pk, thread.pk, sender.pk, text, reply_to_id, now, text])
+            row = cursor.fetchone()
+        if row is None:
+            return None
+
+        msg = cls(
+            id=row[0], thread=thread, sender=sender, message=text, reply_to_id=row[1], created_at=now,
+            attachment_name=row[2],
+        )
+        if row[3] is not None:
+            msg.attachment = Attachment(id=row[3], sha256=row[4], size=row[5], content_type=row[6], has_thumbnail=row[7])
+        msg._state.adding = False
+        msg._state.db = connection.alias
+        return msg
+
     def to_ws_payload(self):
         payload = {
             "id": self.id,
@@ -111,9 +260,76 @@ class DirectMessage(models.Model):
             "created_at": self.created_at.isoformat(),
         }
         if self.reply_to_id:
+            from chat.previews import DM
+            from chat.utils import resolve_reply_previews
+            username, preview = resolve_reply_previews(DM, self.thread_id, [self.reply_to_id]).get(
+                self.reply_to_id, (None, None)
+            )
             payload.update({
                 "reply_to": self.reply_to_id,
-                "reply_to_message": self.reply_to.message,
-                "reply_to_username": getattr(self.reply_to.sender, "username", None),
+                "reply_to_message": preview,
+                "reply_to_username": username,
             })
+        if self.attachment_id:
+            from chat.attachments import attachment_payload
+            payload["attachment"] = attachment_payload("dm", self.id, self.attachment, self.attachment_name)
         return payload
+
+
+class DirectThreadReceipt(models.Model):
+    """Delivery/read watermark of one participant in a DM thread (message ids)."""
+    thread = models.ForeignKey(DirectThread, on_delete=models.CASCADE, related_name="receipts")
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="dm_receipts")
+    delivered_up_to = models.BigIntegerField(default=0)
+    read_up_to = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["thread", "user"], name="unique_dm_receipt"),
+        ]
+
+
+class RoomReadMarker(models.Model):
+    """Last message id a user has read in a room."""
+    room = models.ForeignKey(Room, on_delete=models.CASCADE, related_name="read_markers")
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="room_read_markers")
+    read_up_to = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["room", "user"], name="unique_room_read_marker"),
+        ]
+
+
+class Attachment(models.Model):
+    """
+    A stored file, shared by every message that attaches the same bytes
+    (content-addressed by sha256; see chat/attachments.py for the layout).
+    """
+    sha256 = models.CharField(max_length=64, unique=True)
+    size = models.BigIntegerField()
+    content_type = models.CharField(max_length=100, default="application/octet-stream")
+    has_thumbnail = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.sha256
+
+
+class Upload(models.Model):
+    """A resumable upload in progress (or finished and not yet attached to a message)."""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="uploads")
+    # exactly one of room/thread: where the file may be posted
+    room = models.ForeignKey(Room, null=True, blank=True, on_delete=models.CASCADE, related_name="+")
+    thread = models.ForeignKey(DirectThread, null=True, blank=True, on_delete=models.CASCADE, related_name="+")
+    filename = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    received = models.BigIntegerField(default=0)
+    attachment = models.ForeignKey(Attachment, null=True, blank=True, on_delete=models.CASCADE, related_name="+")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.filename} ({self.received}/{self.size})"
@@ -0,0 +1,201 @@
+"""
+Bounded per-socket outbound buffering.
+
+Group events are pushed into a small deque and a single writer task drains
+it onto the socket. The consumer's channel-layer inbox is therefore always
+read promptly (a slow client can't back up the shared Redis queue until it
+hits capacity for everyone), and a client on a bad link only costs us
+`max_frames` payloads of memory.
+
+Policies when the buffer is full:
+  * drop_oldest - discard the oldest pending frame
+  * coalesce    - like drop_oldest, and frames sharing a coalesce key
+                  (presence snapshots) replace each other while queued
+  * disconnect  - send a `resume` hint with the last delivered message id
+                  and close with 4008; the client reconnects and catches up
+
+Optionally (per room, see Room.batch_window_ms) the writer waits a few
+milliseconds after the first pending frame and sends everything that piled
+up as one JSON array frame, trading a little latency for far fewer frames.
+Every batch gets its own window, so under sustained traffic a socket gets
+at most one frame per window unless batches fill up (batch_max_size).
+"""
+import asyncio
+from collections import deque
+from typing import Any, Awaitable, Callable, Optional
+
+from django.conf import settings
+
+from . import metrics, wire
+
+DROP_OLDEST = "drop_oldest"
+COALESCE = "coalesce"
+DISCONNECT = "disconnect"
+POLICIES = (DROP_OLDEST, COALESCE, DISCONNECT)
+
+CLOSE_SLOW_CONSUMER = 4008
+
+DEFAULT_OUTBOUND = {"max_frames": 256, "policy": DROP_OLDEST}
+
+
+def outbound_config(kind: str) -> dict:
+    """Settings for one consumer kind ("chat" or "dm") merged over the defaults."""
+    conf = dict(DEFAULT_OUTBOUND)
+    conf.update(getattr(settings, "WS_OUTBOUND", {}).get(kind, {}))
+    if conf["policy"] not in POLICIES:
+        raise ValueError(f"unknown outbound policy {conf['policy']!r} for {kind!r}")
+    return conf
+
+
+class OutboundQueue:
+    def __init__(self, send: Callable[[Any], Awaitable[None]], *, kind: str, max_frames: int, policy: str):
+        self._send = send
+        self.kind = kind
+        self.max_frames = max_frames
+        self.policy = policy
+
+        self._frames: deque = deque()          # (coalesce_key, message_id, payload)
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+        self.overflowed = False                # set once under the disconnect policy
+        self.last_message_id: Optional[int] = None
+
+        self.batch_window = 0.0                # seconds; 0 disables batching
+        self.batch_max = 1
+        self._batch_full = asyncio.Event()
+
+    def configure_batching(self, window_ms: int, max_size: int):
+        self.batch_window = max(window_ms, 0) / 1000
+        self.batch_max = max(max_size, 1)
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def __len__(self):
+        return len(self._frames)
+
+    def put(self, payload: Any, coalesce_key: Optional[str] = None, message_id: Optional[int] = None) -> bool:
+        """Queue one payload. Returns False if the socket should be dropped instead."""
+        if self.overflowed:
+            return False
+
+        if coalesce_key and self.policy == COALESCE:
+            for i, (key, _, _) in enumerate(self._frames):
+                if key == coalesce_key:
+                    del self._frames[i]
+                    metrics.incr(f"ws.outbound.coalesced.{self.kind}")
+                    break
+
+        if len(self._frames) >= self.max_frames:
+            if self.policy == DISCONNECT:
+                self.overflowed = True
+                self._frames.clear()
+                metrics.incr(f"ws.outbound.disconnected.{self.kind}")
+                return False
+            self._frames.popleft()
+            metrics.incr(f"ws.outbound.dropped.{self.kind}")
+
+        self._frames.append((coalesce_key, message_id, payload))
+        self._wakeup.set()
+        if len(self._frames) >= self.batch_max:
+            self._batch_full.set()
+        return True
+
+    def _take(self):
+        """Pop the next frame, or up to batch_max frames as one list when batching."""
+        if not self.batch_window:
+            _, message_id, payload = self._frames.popleft()
+            return payload, message_id
+
+        n = min(self.batch_max, len(self._frames))
+        batch = [self._frames.popleft() for _ in range(n)]
+        message_id = next((mid for _, mid, _ in reversed(batch) if mid is not None), None)
+        if n == 1:
+            return batch[0][2], message_id
+        metrics.incr(f"ws.outbound.batches.{self.kind}")
+        metrics.incr(f"ws.outbound.batched_frames.{self.kind}", n)
+        return [p for _, _, p in batch], message_id
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            if self.batch_window and len(self._frames) < self.batch_max:
+                # let the burst build up, but don't sit on a full batch
+                self._batch_full.clear()
+                try:
+                    await asyncio.wait_for(self._batch_full.wait(), self.batch_window)
+                except asyncio.TimeoutError:
+                    pass
+            self._wakeup.clear()
+            while self._frames:
+                payload, message_id = self._take()
+                try:
+                    await self._send(payload)
+                except Exception:
+                    # socket is gone; disconnect() will stop us
+                    self._frames.clear()
+                    break
+                if message_id is not None:
+                    self.last_message_id = message_id
+                if self.batch_window:
+                    # what's left (or came in during the send) gets its own window,
+                    # so a steady stream is still sent a batch per window
+                    if self._frames:
+                        self._wakeup.set()
+                    break
+
+
+class OutboundMixin:
+    """
+    Mixed into the websocket consumers. Everything sent to the client after
+    accept() should go through `queue_payload` so ordering is preserved.
+    """
+    outbound_kind = "chat"
+
+    def start_outbound(self):
+        conf = outbound_config(self.outbound_kind)
+        self.outbound = OutboundQueue(self.send_payload, kind=self.outbound_kind, **conf)
+        self.outbound.start()
+
+    async def stop_outbound(self):
+        outbound = getattr(self, "outbound", None)
+        if outbound is not None:
+            await outbound.stop()
+
+    async def queue_payload(self, payload: Any, coalesce_key: Optional[str] = None, message_id: Optional[int] = None):
+        outbound = getattr(self, "outbound", None)
+        if outbound is None:
+            await self.send_payload(payload)
+            return
+        if outbound.put(payload, coalesce_key=coalesce_key, message_id=message_id):
+            return
+        if not getattr(self, "_slow_consumer_closed", False):
+            self._slow_consumer_closed = True
+            await self.send_payload({
+                "type": "resume",
+                "reason": "slow_consumer",
+                "last_id": outbound.last_message_id,
+            })
+            await self.close(code=CLOSE_SLOW_CONSUMER)
+
+    async def accept_negotiated(self):
+        """accept(), switching this socket to msgpack if the client asked for it."""
+        subprotocol = wire.negotiate_subprotocol(self.scope)
+        self.wire_binary = subprotocol == wire.MSGPACK_SUBPROTOCOL
+        await self.accept(subprotocol)
+
+    def decode_frame(self, text_data=None, bytes_data=None) -> Optional[dict]:
+        return wire.decode(text_data, bytes_data)
+
+    async def send_payload(self, payload: Any):
+        await self.send(**wire.encode(payload, getattr(self, "wire_binary", False)))
@@ -0,0 +1,72 @@
+"""
+Bounded in-process cache of reply previews.
+
+    (kind, message id) -> (room/thread id, sender username, preview text)
+
+Replies cluster around a handful of recent messages, so resolving the
+parent of a reply is almost always a cache hit instead of a query plus a
+Fernet decrypt. Entries are filled when messages are created or rendered,
+and dropped by the post_delete signals in chat/signals.py.
+
+Decrypted text deliberately stays in process memory (never Redis). Other
+workers learn about deletes only through PREVIEW_TTL, which bounds how long
+a deleted message's preview can linger there.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from django.conf import settings
+
+ROOM = "room"
+DM = "dm"
+
+PREVIEW_LEN = 140
+PREVIEW_CACHE_SIZE = getattr(settings, "REPLY_PREVIEW_CACHE_SIZE", 10_000)
+PREVIEW_TTL = getattr(settings, "REPLY_PREVIEW_TTL", 300)   # seconds
+
+
+class PreviewCache:
+    def __init__(self, maxsize: int = PREVIEW_CACHE_SIZE, ttl: float = PREVIEW_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[tuple, tuple]" = OrderedDict()
+        # views run in threads and consumers hop through database_sync_to_async
+        self._lock = threading.Lock()
+
+    def get(self, kind: str, message_id: int, scope_id: int) -> Optional[Tuple[Optional[str], str]]:
+        """(username, preview) if cached and the message belongs to `scope_id`."""
+        key = (kind, message_id)
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            entry_scope, username, preview, expires = entry
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+        if entry_scope != scope_id:
+            return None
+        return username, preview
+
+    def put(self, kind: str, message_id: int, scope_id: int, username: Optional[str], text: str):
+        entry = (scope_id, username, (text or "")[:PREVIEW_LEN], time.monotonic() + self.ttl)
+        key = (kind, message_id)
+        with self._lock:
+            self._data[key] = entry
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, kind: str, message_id: int):
+        with self._lock:
+            self._data.pop((kind, message_id), None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+previews = PreviewCache()
@@ -0,0 +1,269 @@
+"""
+On-demand sampling profiler for staff.
+
+With PROFILING_ENABLED set, a staff user can profile
+
+  * one HTTP request: `?_profile=1` or an `X-Profile: 1` header
+    (ProfileMiddleware), and
+  * the next N frames on a room/DM socket: send
+    `{"action": "profile", "messages": N}` (ProfileMixin).
+
+A single sampler thread wakes every PROFILE_INTERVAL seconds while any
+profile is running and records the target's stack:
+
+  * an HTTP request is sampled on the thread running the view;
+  * a consumer is sampled on the event loop thread while its task is
+    running, and as its chain of awaits (coroutine frames) while it is
+    suspended, so time spent waiting on the DB thread or Redis shows up
+    too (wall clock, not CPU).
+
+Samples inside Django's DB layer or a database_sync_to_async call get a
+`[sql]` leaf, and samples inside redis-py get `[redis]`. Each profile is
+written to PROFILE_DIR in folded-stack format (`a;b;c count` per line),
+which flamegraph.pl and speedscope read as is. The summary (file name,
+samples, estimated SQL/Redis ms) goes back in the `X-Profile` response
+header or as a `{"type": "profile"}` frame.
+
+With PROFILING_ENABLED off the middleware removes itself at startup and
+the mixin hooks cost one attribute check per frame. No sampler thread is
+started until a profile is requested.
+"""
+import asyncio
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from typing import Optional
+
+from channels.db import DatabaseSyncToAsync
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from . import metrics
+
+PROFILING_ENABLED = getattr(settings, "PROFILING_ENABLED", False)
+PROFILE_INTERVAL = getattr(settings, "PROFILE_INTERVAL", 0.005)       # seconds between samples
+PROFILE_MAX_MESSAGES = getattr(settings, "PROFILE_MAX_MESSAGES", 100)
+PROFILE_DIR = getattr(settings, "PROFILE_DIR", os.path.join(tempfile.gettempdir(), "djchat-profiles"))
+
+SQL, REDIS = "[sql]", "[redis]"
+_STRIP_PATHS = sorted({p for p in sys.path if p}, key=len, reverse=True)
+
+
+def _frame_name(code) -> str:
+    filename = code.co_filename
+    for prefix in _STRIP_PATHS:
+        if filename.startswith(prefix):
+            filename = filename[len(prefix):].lstrip(os.sep)
+            break
+    return f"{getattr(code, 'co_qualname', code.co_name)} ({filename})"
+
+
+def _kind(frame, suspended: bool) -> Optional[str]:
+    filename = frame.f_code.co_filename
+    if f"{os.sep}django{os.sep}db{os.sep}" in filename:
+        return SQL
+    if f"{os.sep}redis{os.sep}" in filename:
+        return REDIS
+    # awaiting the DB thread; only peek at locals of frames that aren't running
+    if suspended and frame.f_code.co_name == "__call__" and f"{os.sep}asgiref{os.sep}" in filename:
+        if isinstance(frame.f_locals.get("self"), DatabaseSyncToAsync):
+            return SQL
+    return None
+
+
+def _running(coro) -> bool:
+    return bool(getattr(coro, "cr_running", None) or getattr(coro, "gi_running", None))
+
+
+def _db_call(frame) -> Optional[str]:
+    """`create_message_and_event (db thread)` for a suspended database_sync_to_async frame."""
+    func = getattr(frame.f_locals.get("self"), "func", None)
+    return f"{getattr(func, '__qualname__', '?')} (db thread)" if func is not None else None
+
+
+class Profile:
+    def __init__(self, label: str, thread_id: int, task: Optional[asyncio.Task] = None):
+        self.label = label
+        self.thread_id = thread_id
+        self.task = task                   # consumers: the connection's task on the loop thread
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.kinds: Counter = Counter()
+        self.active = 0.0                  # seconds actually profiled
+        self.resumed = 0.0
+
+    def take(self, frames: dict):
+        """One sample; called from the sampler thread."""
+        # the task's outermost coroutine is running exactly while the loop is stepping the task
+        suspended = self.task is not None and not _running(self.task.get_coro())
+        if not suspended:
+            frame = frames.get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(frame)
+                frame = frame.f_back
+            stack.reverse()
+        else:
+            stack = self._await_chain()
+        if not stack:
+            return
+        names = [self.label]
+        kind = None
+        for frame in stack:
+            names.append(_frame_name(frame.f_code))
+            frame_kind = _kind(frame, suspended)
+            if frame_kind is SQL and suspended and frame.f_code.co_name == "__call__":
+                names.append(_db_call(frame) or "?")
+            kind = frame_kind or kind
+        if kind:
+            names.append(kind)
+            self.kinds[kind] += 1
+        self.stacks[";".join(names)] += 1
+        self.samples += 1
+
+    def _await_chain(self) -> list:
+        stack = []
+        awaitable = self.task.get_coro()
+        while awaitable is not None:
+            if isinstance(awaitable, asyncio.Task):
+                awaitable = awaitable.get_coro()
+                continue
+            frame = getattr(awaitable, "cr_frame", None) or getattr(awaitable, "gi_frame", None)
+            if frame is None:
+                break
+            stack.append(frame)
+            awaitable = getattr(awaitable, "cr_await", None) or getattr(awaitable, "gi_yieldfrom", None)
+        return stack
+
+    def save(self) -> dict:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        slug = re.sub(r"[^\w.-]+", "_", self.label)[:80]
+        path = os.path.join(PROFILE_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{slug}.folded")
+        with open(path, "w") as fh:
+            for stack, count in self.stacks.most_common():
+                fh.write(f"{stack} {count}\n")
+        metrics.incr("profile.saved")
+        ms = lambda n: round(n * PROFILE_INTERVAL * 1000, 1)
+        return {
+            "file": os.path.basename(path),
+            "samples": self.samples,
+            "wall_ms": round(self.active * 1000, 1),
+            "sql_ms": ms(self.kinds[SQL]),
+            "redis_ms": ms(self.kinds[REDIS]),
+        }
+
+
+class Sampler:
+    """One per process; its thread only runs while at least one profile is active."""
+
+    def __init__(self):
+        self._profiles = set()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self, profile: Profile):
+        profile.resumed = time.perf_counter()
+        with self._lock:
+            self._profiles.add(profile)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="djchat-profiler", daemon=True)
+                self._thread.start()
+
+    def pause(self, profile: Profile):
+        with self._lock:
+            self._profiles.discard(profile)
+        profile.active += time.perf_counter() - profile.resumed
+
+    def finish(self, profile: Profile) -> dict:
+        self.pause(profile)
+        return profile.save()
+
+    def _run(self):
+        while True:
+            time.sleep(PROFILE_INTERVAL)
+            with self._lock:
+                if not self._profiles:
+                    self._thread = None
+                    return
+                profiles = list(self._profiles)
+            frames = sys._current_frames()
+            for profile in profiles:
+                try:
+                    profile.take(frames)
+                except Exception:
+                    pass   # a frame went away mid-walk; skip the sample
+
+
+sampler = Sampler()
+
+
+def _wants_profile(request) -> bool:
+    return bool(request.GET.get("_profile") or request.headers.get("X-Profile"))
+
+
+class ProfileMiddleware:
+    """
+    Goes after AuthenticationMiddleware.
+
+    Only the view is profiled. A streaming response (the room page with
+    ROOM_STREAM_HISTORY) produces its body after this returns, on the event
+    loop and in sync_to_async threads, so its profile covers the page shell
+    and not the history chunks.
+    """
+
+    def __init__(self, get_response):
+        if not PROFILING_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not (_wants_profile(request) and request.user.is_staff):
+            return self.get_response(request)
+        profile = Profile(f"{request.method} {request.path}", threading.get_ident())
+        sampler.start(profile)
+        try:
+            response = self.get_response(request)
+        finally:
+            summary = sampler.finish(profile)
+        response["X-Profile"] = "; ".join(f"{k}={v}" for k, v in summary.items())
+        return response
+
+
+class ProfileMixin:
+    """
+    Goes before OutboundMixin in the consumer bases; needs `room_name` and
+    `outbound_kind`. The `profile` action is swallowed here.
+    """
+    _profile: Optional[Profile] = None
+
+    def decode_frame(self, text_data=None, bytes_data=None) -> Optional[dict]:
+        data = super().decode_frame(text_data, bytes_data)
+        if PROFILING_ENABLED and data is not None and data.get("action") == "profile":
+            user = self.scope.get("user")
+            if getattr(user, "is_staff", False) and self._profile is None:
+                try:
+                    messages = int(data.get("messages") or 10)
+                except (TypeError, ValueError):
+                    messages = 10
+                self._profile_left = max(1, min(messages, PROFILE_MAX_MESSAGES))
+                self._profile = Profile(f"{self.outbound_kind}:{self.room_name}", threading.get_ident(), asyncio.current_task())
+            return None
+        return data
+
+    async def websocket_receive(self, message):
+        profile = self._profile
+        if profile is None:
+            return await super().websocket_receive(message)
+        sampler.start(profile)
+        try:
+            await super().websocket_receive(message)
+        finally:
+            sampler.pause(profile)
+        self._profile_left -= 1
+        if self._profile_left <= 0:
+            self._profile = None
+            await self.queue_payload({"type": "profile", **profile.save()})
@@ -0,0 +1,166 @@
+"""
+Delivery/read receipts.
+
+Acks are watermarks (the highest message id delivered/read), so a client
+catching up on 500 messages sends one ack, and many acks for the same
+thread/room collapse into one pending row. Pending rows live in memory and
+a background task writes them to Postgres every RECEIPT_FLUSH_EVERY seconds
+with one bulk upsert per table. GREATEST() keeps the watermarks monotonic
+even if two workers flush out of order.
+"""
+import asyncio
+from typing import Dict, Tuple
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import DatabaseError, connection, transaction
+from django.utils import timezone
+
+from . import metrics
+from .models import DirectThread, DirectThreadReceipt, Room, RoomReadMarker
+
+User = get_user_model()
+
+RECEIPT_FLUSH_EVERY = getattr(settings, "RECEIPT_FLUSH_EVERY", 2.0)    # seconds
+RECEIPT_FANOUT_DELAY = getattr(settings, "RECEIPT_FANOUT_DELAY", 0.5)  # seconds
+UPSERT_CHUNK = 1000
+MAX_ACK_ID = 2 ** 63 - 1   # BigIntegerField
+
+
+class ReceiptBuffer:
+    def __init__(self):
+        self._dm: Dict[Tuple[int, int], list] = {}     # (thread_id, user_id) -> [delivered, read]
+        self._room: Dict[Tuple[int, int], int] = {}    # (room_id, user_id) -> read
+        self._flusher = None
+
+    def __len__(self):
+        return len(self._dm) + len(self._room)
+
+    def ack_dm(self, thread_id: int, user_id: int, delivered: int = 0, read: int = 0):
+        delivered = max(delivered, read)
+        row = self._dm.setdefault((thread_id, user_id), [0, 0])
+        row[0] = max(row[0], delivered)
+        row[1] = max(row[1], read)
+        self._ensure_flusher()
+
+    def ack_room(self, room_id: int, user_id: int, read: int):
+        key = (room_id, user_id)
+        self._room[key] = max(self._room.get(key, 0), read)
+        self._ensure_flusher()
+
+    async def flush(self):
+        if not self:
+            return
+        dm, self._dm = self._dm, {}
+        room, self._room = self._room, {}
+        try:
+            await database_sync_to_async(_write_receipts)(dm, room)
+        except Exception:
+            # put them back; they are watermarks so merging is idempotent
+            for (thread_id, user_id), (delivered, read) in dm.items():
+                self.ack_dm(thread_id, user_id, delivered, read)
+            for (room_id, user_id), read in room.items():
+                self.ack_room(room_id, user_id, read)
+            raise
+        metrics.incr("receipts.flushed_rows", len(dm) + len(room))
+
+    def _ensure_flusher(self):
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.get_running_loop().create_task(self._flush_forever())
+
+    async def _flush_forever(self):
+        while True:
+            await asyncio.sleep(RECEIPT_FLUSH_EVERY)
+            try:
+                await self.flush()
+            except Exception:
+                metrics.incr("receipts.flush_errors")
+
+
+# One per process; consumers only ever touch it from the event loop.
+buffer = ReceiptBuffer()
+
+
+def _upsert(table: str, columns: str, conflict: str, updates: str, rows: list):
+    width = len(rows[0])
+    row_sql = "(" + ", ".join(["%s"] * width) + ")"
+    with connection.cursor() as cursor:
+        for i in range(0, len(rows), UPSERT_CHUNK):
+            chunk = rows[i:i + UPSERT_CHUNK]
+            cursor.execute(
+                f"INSERT INTO {table} ({columns}) VALUES {', '.join([row_sql] * len(chunk))} "
+                f"ON CONFLICT ({conflict}) DO UPDATE SET {updates}",
+                [v for row in chunk for v in row],
+            )
+
+
+def _alive(dm: dict, room: dict) -> tuple:
+    """Drop rows whose thread/room/user was deleted since the ack; they would fail the FK check."""
+    users = set(User.objects.filter(id__in={u for _, u in dm} | {u for _, u in room}).values_list("id", flat=True))
+    if dm:
+        threads = set(DirectThread.objects.filter(id__in={t for t, _ in dm}).values_list("id", flat=True))
+        dm = {key: row for key, row in dm.items() if key[0] in threads and key[1] in users}
+    if room:
+        rooms = set(Room.objects.filter(id__in={r for r, _ in room}).values_list("id", flat=True))
+        room = {key: read for key, read in room.items() if key[0] in rooms and key[1] in users}
+    return dm, room
+
+
+def _write_receipts(dm: dict, room: dict):
+    try:
+        with transaction.atomic():
+            _upsert_receipts(*_alive(dm, room))
+    except DatabaseError:
+        # something was deleted between the check and the insert, or a row is
+        # otherwise unwritable: check again and write row by row, dropping what
+        # still fails rather than re-queueing it on every flush
+        dm, room = _alive(dm, room)
+        dropped = 0
+        for key, row in dm.items():
+            dropped += not _write_one({key: row}, {})
+        for key, read in room.items():
+            dropped += not _write_one({}, {key: read})
+        if dropped:
+            metrics.incr("receipts.dropped_rows", dropped)
+
+
+def _write_one(dm: dict, room: dict) -> bool:
+    try:
+        with transaction.atomic():
+            _upsert_receipts(dm, room)
+    except DatabaseError:
+        return False
+    return True
+
+
+def _upsert_receipts(dm: dict, room: dict):
+    now = timezone.now()
+    if dm:
+        table = DirectThreadReceipt._meta.db_table
+        _upsert(
+            table,
+            "thread_id, user_id, delivered_up_to, read_up_to, updated_at",
+            "thread_id, user_id",
+            f"delivered_up_to = GREATEST({table}.delivered_up_to, EXCLUDED.delivered_up_to), "
+            f"read_up_to = GREATEST({table}.read_up_to, EXCLUDED.read_up_to), "
+            f"updated_at = EXCLUDED.updated_at",
+            [(t, u, d, r, now) for (t, u), (d, r) in dm.items()],
+        )
+    if room:
+        table = RoomReadMarker._meta.db_table
+        _upsert(
+            table,
+            "room_id, user_id, read_up_to, updated_at",
+            "room_id, user_id",
+            f"read_up_to = GREATEST({table}.read_up_to, EXCLUDED.read_up_to), "
+            f"updated_at = EXCLUDED.updated_at",
+            [(r, u, read, now) for (r, u), read in room.items()],
+        )
+
+
+def parse_ack_id(value) -> int:
+    try:
+        return min(max(int(value or 0), 0), MAX_ACK_ID)
+    except (TypeError, ValueError, OverflowError):
+        return 0
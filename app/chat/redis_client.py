@@ -0,0 +1,10 @@
+"""Shared Redis clients for presence, metrics and other websocket state."""
+from django.conf import settings
+from redis import Redis as SyncRedis
+from redis.asyncio import Redis
+
+REDIS_URL = getattr(settings, "PRESENCE_REDIS_URL", "redis://redis:6379/1")
+
+REDIS: Redis = Redis.from_url(REDIS_URL)
+# for views, signals and commands (sync code)
+REDIS_SYNC: SyncRedis = SyncRedis.from_url(REDIS_URL)
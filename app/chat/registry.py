@@ -0,0 +1,111 @@
+"""
+Room registry: resolves a room name from a URL or a websocket route to the
+few fields the hot paths need, without touching Postgres.
+
+Lookups go process-local dict -> shared Django cache (Redis) -> one indexed
+query on Room.slug. The Fernet keys never go to the shared tier (Redis holds
+no plaintext keys, as with chat/previews.py): a shared hit loads them with
+one primary-key query into the local entry. Room post_save/post_delete
+signals (chat/signals.py) drop both tiers; other workers' local tier expires
+after ROOM_REGISTRY_LOCAL_TTL seconds.
+"""
+import threading
+import time
+from typing import NamedTuple, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+
+from chat.models import Room, get_fernet, normalize_room_name
+from cryptography.fernet import MultiFernet
+
+ROOM_REGISTRY_LOCAL_TTL = getattr(settings, "ROOM_REGISTRY_LOCAL_TTL", 30)   # seconds
+ROOM_REGISTRY_TTL = getattr(settings, "ROOM_REGISTRY_TTL", 3600)             # seconds
+ROOM_REGISTRY_LOCAL_SIZE = 5000
+
+# bump when RoomInfo changes shape so old cached tuples are ignored
+_VERSION = 3
+
+
+class RoomInfo(NamedTuple):
+    id: int
+    slug: str
+    name: str
+    encryption_key: str
+    previous_keys: str
+    creator_id: Optional[int]
+    batch_window_ms: int
+    batch_max_size: int
+
+    def as_room(self) -> Room:
+        """A Room instance for FK assignment / encryption, built without a query."""
+        room = Room(
+            id=self.id, slug=self.slug, name=self.name,
+            encryption_key=self.encryption_key, previous_keys=self.previous_keys, creator_id=self.creator_id,
+            batch_window_ms=self.batch_window_ms, batch_max_size=self.batch_max_size,
+        )
+        room._state.adding = False
+        room._state.db = "default"
+        return room
+
+    def fernet(self) -> MultiFernet:
+        return get_fernet(self.encryption_key, self.previous_keys)
+
+
+# kept in the local tier only
+_SECRET_FIELDS = ("encryption_key", "previous_keys")
+_SHARED_FIELDS = tuple(f for f in RoomInfo._fields if f not in _SECRET_FIELDS)
+
+
+def _k_room(slug: str) -> str:
+    return f"room:v{_VERSION}:slug:{slug}"
+
+
+class RoomRegistry:
+    def __init__(self):
+        self._local = {}   # slug -> (expires_at, RoomInfo)
+        self._lock = threading.Lock()
+
+    def resolve(self, name: str) -> Optional[RoomInfo]:
+        slug = normalize_room_name(name)
+        if not slug:
+            return None
+
+        now = time.monotonic()
+        with self._lock:
+            hit = self._local.get(slug)
+        if hit and hit[0] > now:
+            return hit[1]
+
+        shared = cache.get(_k_room(slug))
+        if shared is not None:
+            keys = Room.objects.filter(pk=shared["id"]).values_list(*_SECRET_FIELDS).first()
+            if keys is None:
+                cache.delete(_k_room(slug))   # deleted since; fall through to the slug query
+                shared = None
+            else:
+                info = RoomInfo(**shared, **dict(zip(_SECRET_FIELDS, keys)))
+        if shared is None:
+            row = (
+                Room.objects.filter(slug=slug)
+                .values_list(*RoomInfo._fields)
+                .first()
+            )
+            if row is None:
+                return None   # not cached: a room created elsewhere must show up at once
+            info = RoomInfo(*row)
+            cache.set(_k_room(slug), {f: getattr(info, f) for f in _SHARED_FIELDS}, ROOM_REGISTRY_TTL)
+
+        with self._lock:
+            if len(self._local) >= ROOM_REGISTRY_LOCAL_SIZE:
+                self._local.clear()
+            self._local[slug] = (now + ROOM_REGISTRY_LOCAL_TTL, info)
+        return info
+
+    def invalidate(self, slug: str):
+        with self._lock:
+            self._local.pop(slug, None)
+        cache.delete(_k_room(slug))
+
+
+registry = RoomRegistry()
@@ -3,6 +3,7 @@ from django.urls import re_path
 from . import consumers
 
 websocket_urlpatterns = [
-    re_path(r"ws/chat/(?P<room_name>\w+)/$", consumers.ChatConsumer.as_asgi()),
+    re_path(r"ws/chat/(?P<room_name>[-\w]+)/$", consumers.ChatConsumer.as_asgi()),
     re_path(r"ws/person/(?P<chat>[^/]+)/$", consumers.DirectMessageConsumer.as_asgi()),
+    re_path(r"ws/inbox/$", consumers.InboxConsumer.as_asgi()),
 ]
@@ -0,0 +1,79 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from chat import inbox, membership, user_rooms
+
+from chat.models import Message, DirectMessage, Room
+from chat.previews import previews, ROOM, DM
+from chat.registry import registry
+
+
+@receiver(post_delete, sender=Message)
+def drop_message_preview(sender, instance, **kwargs):
+    previews.invalidate(ROOM, instance.pk)
+
+
+@receiver(post_delete, sender=DirectMessage)
+def drop_direct_message_preview(sender, instance, **kwargs):
+    previews.invalidate(DM, instance.pk)
+
+
+@receiver(post_save, sender=Room)
+@receiver(post_delete, sender=Room)
+def drop_registry_entry(sender, instance, **kwargs):
+    registry.invalidate(instance.slug)
+    renamed_from = instance.__dict__.pop("_renamed_from", None)
+    if renamed_from:
+        registry.invalidate(renamed_from)
+
+
+@receiver(post_delete, sender=Room)
+def drop_room_members(sender, instance, **kwargs):
+    room_id = instance.pk
+    transaction.on_commit(lambda: membership.forget({room_id}))
+
+
+@receiver(pre_delete, sender=Room)
+def drop_member_room_indexes(sender, instance, **kwargs):
+    # the membership rows go with the room without an m2m_changed signal
+    room_id, user_ids = instance.pk, list(instance.granted_users.values_list("id", flat=True))
+    transaction.on_commit(lambda: user_rooms.invalidate(user_ids, {room_id}))
+
+
+@receiver(post_save, sender=Room)
+def rename_in_room_indexes(sender, instance, created, update_fields=None, **kwargs):
+    if created or (update_fields is not None and "name" not in update_fields):
+        return
+    user_ids = list(instance.granted_users.values_list("id", flat=True))
+    transaction.on_commit(lambda: user_rooms.invalidate(user_ids))
+
+
+@receiver(m2m_changed, sender=Room.granted_users.through)
+def mirror_room_members(sender, instance, action, reverse, pk_set, **kwargs):
+    # reverse=True means the change came from the user side (user.room_set.add(...))
+    if action == "pre_clear":
+        if reverse:
+            instance._cleared_room_ids = set(instance.room_set.values_list("id", flat=True))
+        else:
+            instance._cleared_user_ids = set(instance.granted_users.values_list("id", flat=True))
+        return
+    if action == "post_clear":
+        room_ids = getattr(instance, "_cleared_room_ids", set()) if reverse else {instance.pk}
+        user_ids = {instance.pk} if reverse else getattr(instance, "_cleared_user_ids", set())
+        transaction.on_commit(lambda: membership.forget(room_ids))
+        transaction.on_commit(lambda: user_rooms.invalidate(user_ids, room_ids))
+        transaction.on_commit(lambda: inbox.notify_left(room_ids, user_ids))
+        return
+    if action not in ("post_add", "post_remove") or not pk_set:
+        return
+
+    room_ids, user_ids = (set(pk_set), {instance.pk}) if reverse else ({instance.pk}, set(pk_set))
+    apply = membership.add if action == "post_add" else membership.remove
+    # only mirror what actually committed
+    transaction.on_commit(lambda: apply(room_ids, user_ids))
+    transaction.on_commit(lambda: user_rooms.invalidate(user_ids, room_ids))
+    if action == "post_add":
+        transaction.on_commit(lambda: inbox.notify_joined(room_ids, user_ids))
+    else:
+        transaction.on_commit(lambda: inbox.notify_left(room_ids, user_ids))
@@ -0,0 +1,145 @@
+import asyncio
+import hashlib
+import io
+import os
+import tempfile
+import time
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.test import SimpleTestCase, TestCase
+
+from chat import attachments, metrics, receipts
+from chat.consumers import SYNC_MAX, ChatConsumer
+from chat.outbound import DROP_OLDEST, OutboundQueue
+from chat.models import Attachment, DirectThread, DirectThreadReceipt, Room, RoomReadMarker, Upload
+
+
+class ReceiptWriteTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create(username="alice")
+        self.bob = User.objects.create(username="bob")
+        self.thread = DirectThread.get_or_create_for_users(self.alice, self.bob)
+        self.room = Room.objects.create(name="receipts", creator=self.alice)
+
+    def test_oversized_ack_is_clamped(self):
+        for value in (2 ** 64, str(2 ** 64), 1e30, float("inf")):
+            self.assertLessEqual(receipts.parse_ack_id(value), receipts.MAX_ACK_ID)
+        self.assertEqual(receipts.parse_ack_id(2 ** 64), receipts.MAX_ACK_ID)
+
+    def test_unwritable_row_is_dropped_not_requeued(self):
+        dropped = metrics.snapshot().get("receipts.dropped_rows", 0)
+        receipts._write_receipts(
+            {(self.thread.id, self.alice.id): [2 ** 64, 3]},
+            {(self.room.id, self.alice.id): 2 ** 64, (self.room.id, self.bob.id): 7},
+        )
+        self.assertEqual(metrics.snapshot()["receipts.dropped_rows"] - dropped, 2)
+        self.assertFalse(DirectThreadReceipt.objects.exists())
+        self.assertEqual(
+            list(RoomReadMarker.objects.values_list("user_id", "read_up_to")), [(self.bob.id, 7)]
+        )
+
+
+class StubThrottle:
+    """Answers check() from a script: None to allow, seconds to reject."""
+
+    def __init__(self, *answers):
+        self.answers = list(answers)
+
+    async def check(self):
+        return self.answers.pop(0) if self.answers else None
+
+
+class SyncThrottleTests(SimpleTestCase):
+    def consumer(self, sync_answers):
+        consumer = ChatConsumer()
+        consumer.throttle = StubThrottle(*[5.0] * 20)   # the chat bucket is empty throughout
+        consumer.sync_throttle = StubThrottle(*sync_answers)
+        consumer._sync_budget = SYNC_MAX
+        consumer.frames = []
+
+        async def queue_payload(payload, **kwargs):
+            consumer.frames.append(payload)
+
+        async def load_events_since(last_id, limit):
+            return [{"type": "chat_message", "id": last_id + 1}], False
+
+        consumer.queue_payload = queue_payload
+        consumer.load_events_since = load_events_since
+        return consumer
+
+    async def test_throttled_sync_recovers(self):
+        consumer = self.consumer([0.25, None])
+        await consumer._catch_up(5)
+        throttled = consumer.frames[-1]
+        self.assertEqual((throttled["type"], throttled["last_id"], throttled["retry_after"]), ("sync", 5, 0.25))
+        self.assertEqual(throttled["messages"], [])
+
+        # what the page does after retry_after: the same cursor again
+        await consumer._catch_up(throttled["last_id"])
+        page = consumer.frames[-1]
+        self.assertNotIn("retry_after", page)
+        self.assertEqual([m["id"] for m in page["messages"]], [6])
+
+
+class OutboundBatchingTests(SimpleTestCase):
+    async def test_window_applies_to_every_batch_under_sustained_load(self):
+        sent = []
+
+        async def send(payload):
+            sent.append(payload if isinstance(payload, list) else [payload])
+            await asyncio.sleep(0.005)   # a slow-ish socket write
+
+        queue = OutboundQueue(send, kind="test", max_frames=1000, policy=DROP_OLDEST)
+        queue.configure_batching(window_ms=30, max_size=100)
+        queue.start()
+        try:
+            start = time.monotonic()
+            for i in range(150):          # one frame per ms for ~150 ms
+                queue.put({"id": i}, message_id=i)
+                await asyncio.sleep(0.001)
+            while len(queue):
+                await asyncio.sleep(0.01)
+            await asyncio.sleep(0.05)
+            elapsed = time.monotonic() - start
+        finally:
+            await queue.stop()
+
+        self.assertEqual([p["id"] for batch in sent for p in batch], list(range(150)))
+        # one send per window (plus the last one), not one per socket write
+        self.assertLessEqual(len(sent), elapsed / 0.030 + 2)
+
+
+class UploadFinishTests(TestCase):
+    data = b"not an image, just bytes"
+
+    def setUp(self):
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        patcher = mock.patch.object(attachments, "ATTACHMENT_ROOT", root.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User.objects.create(username="uploader")
+        room = Room.objects.create(name="uploads", creator=self.user)
+        self.upload = Upload.objects.create(user=self.user, room=room, filename="a.bin", size=len(self.data))
+        self.blob = attachments.blob_path(hashlib.sha256(self.data).hexdigest())
+
+    def finish(self):
+        attachments.write_chunk(self.upload.pk, self.user.id, 0, io.BytesIO(self.data))
+
+    def test_rollback_keeps_the_part_and_stores_nothing(self):
+        with self.captureOnCommitCallbacks(execute=True), self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                self.finish()
+                raise RuntimeError("after finish_upload")
+        self.assertTrue(os.path.exists(attachments.part_path(self.upload.pk)))
+        self.assertFalse(os.path.exists(self.blob))
+        self.assertFalse(Attachment.objects.exists())
+
+    def test_commit_moves_the_part_into_place(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.finish()
+        self.assertFalse(os.path.exists(attachments.part_path(self.upload.pk)))
+        with open(self.blob, "rb") as f:
+            self.assertEqual(f.read(), self.data)
@@ -0,0 +1,103 @@
+"""
+Token-bucket throttling for inbound websocket frames.
+
+Each (kind, user, target) pair has a bucket in Redis that refills at `rate`
+tokens per second up to `burst`. A Lua script refills and takes a token
+atomically, so every worker shares the same bucket. Each connection also
+keeps a local copy of the bucket: the shared one can only hold fewer tokens
+than ours (other sockets of the same user drain it too), so when the local
+copy is empty the frame is rejected without a Redis round trip.
+
+Limits live in settings.WS_RATE_LIMITS, keyed by consumer kind.
+"""
+import time
+from typing import Optional
+
+from django.conf import settings
+
+from . import metrics
+from .redis_client import REDIS
+
+DEFAULT_RATE_LIMIT = {"rate": 1.0, "burst": 10}
+
+# KEYS[1] bucket; ARGV rate, burst -> {allowed, tokens_left, retry_after}
+TOKEN_BUCKET_LUA = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+
+local allowed = 0
+local retry_after = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+else
+    retry_after = (1 - tokens) / rate
+end
+
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return {allowed, tostring(tokens), tostring(retry_after)}
+"""
+
+_token_bucket = REDIS.register_script(TOKEN_BUCKET_LUA)
+
+
+def _k_bucket(kind: str, user_key, target: str) -> str:
+    return f"ratelimit:ws:{kind}:{user_key}:{target}"     # HASH { tokens, ts }
+
+
+def rate_limit_config(kind: str) -> dict:
+    conf = dict(DEFAULT_RATE_LIMIT)
+    conf.update(getattr(settings, "WS_RATE_LIMITS", {}).get(kind, {}))
+    return conf
+
+
+class FrameThrottle:
+    """One per connection. `check()` returns None when allowed, else seconds to wait."""
+
+    def __init__(self, kind: str, user_key, target: str):
+        conf = rate_limit_config(kind)
+        self.kind = kind
+        self.rate = float(conf["rate"])
+        self.burst = float(conf["burst"])
+        self.key = _k_bucket(kind, user_key, target)
+
+        self._tokens = self.burst
+        self._ts = time.monotonic()
+
+    def _refill_local(self) -> float:
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._ts) * self.rate)
+        self._ts = now
+        return self._tokens
+
+    async def check(self) -> Optional[float]:
+        if self._refill_local() < 1:
+            metrics.incr(f"ws.throttled.{self.kind}.local")
+            return (1 - self._tokens) / self.rate
+
+        try:
+            allowed, tokens, retry_after = await _token_bucket(keys=[self.key], args=[self.rate, self.burst])
+        except Exception:
+            # fail open: a Redis hiccup shouldn't take the chat down
+            metrics.incr(f"ws.throttle.errors.{self.kind}")
+            self._tokens -= 1
+            return None
+
+        # the shared bucket is authoritative
+        self._tokens = float(tokens)
+        if int(allowed):
+            return None
+        metrics.incr(f"ws.throttled.{self.kind}.redis")
+        return float(retry_after)
+
+
+def throttled_payload(retry_after: float) -> dict:
+    return {"type": "error", "code": "throttled", "retry_after": round(retry_after, 3)}
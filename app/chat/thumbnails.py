@@ -0,0 +1,20 @@
+"""
+Thumbnail rendering for image attachments.
+
+Runs inside the process pool started by chat/attachments.py (spawned, not
+forked), so this module must stay importable without Django.
+"""
+import os
+
+
+def render_thumbnail(src: str, dst: str, size: tuple) -> bool:
+    from PIL import Image
+
+    with Image.open(src) as image:
+        image.thumbnail(size)
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        tmp = f"{dst}.tmp"
+        image.save(tmp, format="JPEG", quality=80, optimize=True)
+    os.replace(tmp, dst)
+    return True
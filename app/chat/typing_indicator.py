@@ -0,0 +1,92 @@
+"""
+Ephemeral "X is typing…" state. Never touches the database.
+
+Each room/thread keeps a Redis ZSET of typers scored by expiry time, one
+member per socket ("username:channel name"), so a user typing in two tabs
+stays a typer until both stop; broadcasts list each username once. A ping
+from a socket is throttled locally (one per TYPING_THROTTLE seconds per
+connection), refreshes the typer's expiry and, if nobody else has in the
+last TYPING_FANOUT_EVERY seconds, schedules one group broadcast carrying the
+whole set of active typers. Clients drop the indicator after `ttl` seconds
+without a fresh update, so stale typers expire on both sides on their own.
+"""
+import asyncio
+import time
+from typing import List
+
+from django.conf import settings
+
+from .redis_client import REDIS
+
+TYPING_TTL = getattr(settings, "WS_TYPING_TTL", 6)                      # seconds
+TYPING_THROTTLE = getattr(settings, "WS_TYPING_THROTTLE", 2)            # seconds between pings per socket
+TYPING_FANOUT_EVERY = getattr(settings, "WS_TYPING_FANOUT_EVERY", 1.0)  # seconds between broadcasts per group
+
+_pending_fanouts = set()   # keep references to scheduled broadcast tasks
+
+
+def _k_typers(group: str) -> str:
+    return f"typing:{group}"            # ZSET { username:channel_name: expires_at }
+
+def _k_fanout(group: str) -> str:
+    return f"typing:fanout:{group}"     # STRING lock held while a broadcast is scheduled
+
+
+async def active_typers(group: str) -> List[str]:
+    now = time.time()
+    async with REDIS.pipeline(transaction=True) as p:
+        _, names = await (
+            p.zremrangebyscore(_k_typers(group), "-inf", now)
+             .zrange(_k_typers(group), 0, -1)
+             .execute()
+        )
+    names = (n.decode() if isinstance(n, (bytes, bytearray)) else n for n in names)
+    # usernames can't contain ":"; one entry per user however many sockets type
+    return list(dict.fromkeys(n.partition(":")[0] for n in names))
+
+
+class TypingTracker:
+    """One per connection."""
+
+    def __init__(self, channel_layer, group: str, username: str, channel_name: str):
+        self.channel_layer = channel_layer
+        self.group = group
+        self.member = f"{username}:{channel_name}"
+        self._last_ping = 0.0
+
+    async def ping(self, active: bool = True):
+        now = time.time()
+        if active:
+            if now - self._last_ping < TYPING_THROTTLE:
+                return
+            self._last_ping = now
+        elif not self._last_ping:
+            return  # wasn't typing
+        else:
+            self._last_ping = 0.0
+
+        key = _k_typers(self.group)
+        async with REDIS.pipeline(transaction=True) as p:
+            if active:
+                p.zadd(key, {self.member: now + TYPING_TTL})
+            else:
+                p.zrem(key, self.member)
+            p.expire(key, TYPING_TTL * 2)
+            p.set(_k_fanout(self.group), 1, nx=True, px=int(TYPING_FANOUT_EVERY * 1000))
+            scheduled = (await p.execute())[-1]
+
+        if scheduled:
+            task = asyncio.create_task(self._fanout_later())
+            _pending_fanouts.add(task)
+            task.add_done_callback(_pending_fanouts.discard)
+
+    async def stop(self):
+        await self.ping(active=False)
+
+    async def _fanout_later(self):
+        await asyncio.sleep(TYPING_FANOUT_EVERY)
+        typers = await active_typers(self.group)
+        await self.channel_layer.group_send(
+            self.group,
+            {"type": "typing.update", "payload": {"type": "typing", "typers": typers, "ttl": TYPING_TTL}},
+        )
@@ -5,12 +5,17 @@ from . import views
 
 urlpatterns = [
     path('home/', views.chats_homepage, name='home_page'),
+    path('home/inbox/', views.inbox_api, name='inbox_api'),
     # path("", views.index, name="index"),
     path("<str:room_name>/", views.room, name="room"),
     path("room/create/<str:room_name>/", views.create_room, name="room"),
     path("user/invite/", views.user_rooms_list, name='user_rooms_list'),
     path("user/invite/submit/", views.user_invite, name="user-invite-submit"),
+    path("users/search/", views.user_search_view, name="user_search"),
     path("dm/start/", views.user_start_chat, name="dm_start"),
     path("dm/start/<str:username>/", views.dm_start, name="dm_start"),
     path("dm/<str:room_name>/", views.dm_room_view, name="dm_room"),
+    path("attachments/uploads/", views.attachment_upload_start, name="attachment_upload_start"),
+    path("attachments/uploads/<uuid:upload_id>/", views.attachment_upload, name="attachment_upload"),
+    path("attachments/<str:kind>/<int:message_id>/", views.attachment_download, name="attachment_download"),
 ]
\ No newline at end of file
@@ -0,0 +1,122 @@
+"""
+Compact per-user room index for the invite picker, and the invite insert.
+
+    user_rooms:v1:{user_id}   [(room_id, name), ...] the user belongs to
+    room_size:v1:{room_id}    member count
+
+Both live in the Django cache, so rendering the picker never loads a room's
+members: one cache read for the index plus one get_many for the counts.
+The m2m_changed handler in chat/signals.py drops the index of every user
+whose membership changed and the count of every room touched; renaming or
+deleting a room drops its members' indexes.
+"""
+from typing import Iterable, List, NamedTuple
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection, router
+from django.db.models import Count
+from django.db.models.signals import m2m_changed
+
+from .membership import Membership
+from .models import Room
+
+User = get_user_model()
+
+USER_ROOMS_TTL = getattr(settings, "USER_ROOMS_TTL", 3600)   # seconds
+
+
+class UserRoom(NamedTuple):
+    id: int
+    name: str
+    members: int
+
+
+def _k_index(user_id: int) -> str:
+    return f"user_rooms:v1:{user_id}"
+
+
+def _k_size(room_id: int) -> str:
+    return f"room_size:v1:{room_id}"
+
+
+def rooms_for(user_id: int) -> List[UserRoom]:
+    rooms = cache.get(_k_index(user_id))
+    if rooms is None:
+        rooms = list(
+            Membership.objects.filter(user_id=user_id)
+            .order_by("room__name", "room_id")
+            .values_list("room_id", "room__name")
+        )
+        cache.set(_k_index(user_id), rooms, USER_ROOMS_TTL)
+    if not rooms:
+        return []
+
+    keys = {room_id: _k_size(room_id) for room_id, _ in rooms}
+    sizes = cache.get_many(keys.values())
+    missing = [room_id for room_id, key in keys.items() if key not in sizes]
+    if missing:
+        counted = dict(
+            Membership.objects.filter(room_id__in=missing)
+            .order_by().values("room_id").annotate(n=Count("id"))
+            .values_list("room_id", "n")
+        )
+        fresh = {keys[room_id]: counted.get(room_id, 0) for room_id in missing}
+        cache.set_many(fresh, USER_ROOMS_TTL)
+        sizes.update(fresh)
+    return [UserRoom(room_id, name, sizes[keys[room_id]]) for room_id, name in rooms]
+
+
+def invalidate(user_ids: Iterable[int] = (), room_ids: Iterable[int] = ()):
+    keys = [_k_index(user_id) for user_id in user_ids] + [_k_size(room_id) for room_id in room_ids]
+    if keys:
+        cache.delete_many(keys)
+
+
+# Postgres. One statement: is the inviter a member, who is the invitee, insert.
+_INVITE_SQL = """
+WITH inviter AS (
+    SELECT 1 FROM {through} WHERE {room} = %s AND {user} = %s
+), invitee AS (
+    SELECT id FROM {users} WHERE username = %s
+), added AS (
+    INSERT INTO {through} ({room}, {user})
+    SELECT %s, invitee.id FROM invitee WHERE EXISTS (SELECT 1 FROM inviter)
+    ON CONFLICT ({room}, {user}) DO NOTHING
+    RETURNING {user}
+)
+SELECT EXISTS (SELECT 1 FROM inviter), (SELECT id FROM invitee), EXISTS (SELECT 1 FROM added)
+""".format(
+    through=Membership._meta.db_table,
+    room=Membership._meta.get_field("room").column,
+    user=Membership._meta.get_field("user").column,
+    users=User._meta.db_table,
+)
+
+NOT_MEMBER, NO_SUCH_USER, ALREADY_MEMBER, INVITED = "not_member", "no_such_user", "already_member", "invited"
+
+
+def invite(room_id: int, inviter_id: int, username: str) -> str:
+    """Add `username` to the room if the inviter is a member; one of the constants above."""
+    with connection.cursor() as cursor:
+        cursor.execute(_INVITE_SQL, [room_id, inviter_id, username, room_id])
+        is_member, invitee_id, added = cursor.fetchone()
+    if not is_member:
+        return NOT_MEMBER
+    if invitee_id is None:
+        return NO_SUCH_USER
+    if not added:
+        return ALREADY_MEMBER
+    _announce_add(room_id, invitee_id)
+    return INVITED
+
+
+def _announce_add(room_id: int, user_id: int):
+    # what user.room_set.add() would have sent, so the Redis member sets,
+    # the inbox and the index above all hear about it (chat/signals.py)
+    user = User(pk=user_id)
+    m2m_changed.send(
+        sender=Membership, instance=user, action="post_add", reverse=True,
+        model=Room, pk_set={room_id}, using=router.db_for_write(Membership, instance=user),
+    )
@@ -0,0 +1,183 @@
+"""
+Username autocomplete for starting DMs and inviting people to rooms.
+
+Candidates for a prefix come from the case-insensitive prefix index on
+auth_user.username (migration 0011) and are cached per prefix, shared by
+every caller. Each request adds the caller's DM partners and room-mates
+matching the prefix and ranks the lot: exact match, DM partners (most
+recent first), people sharing the most rooms, then alphabetical.
+
+The caller's room-mates are cached per user, sorted by lowercased name so a
+prefix is a bisect. The entry is stamped with the member-set versions of
+the caller's rooms (chat/membership.py), which the membership signals bump,
+so any join or leave in one of those rooms makes it stale.
+"""
+import heapq
+from bisect import bisect_left
+from typing import List, Optional
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Count, Q
+from django.db.models.functions import Collate, Upper
+
+from . import membership, user_rooms
+from .models import DirectThread
+from .membership import Membership
+
+User = get_user_model()
+
+USER_SEARCH_MIN_PREFIX = getattr(settings, "USER_SEARCH_MIN_PREFIX", 2)
+USER_SEARCH_POOL = getattr(settings, "USER_SEARCH_POOL", 50)       # candidates cached per prefix
+USER_SEARCH_LIMIT = getattr(settings, "USER_SEARCH_LIMIT", 10)     # results returned
+USER_SEARCH_CACHE_TTL = getattr(settings, "USER_SEARCH_CACHE_TTL", 60)
+USER_SEARCH_MATES_TTL = getattr(settings, "USER_SEARCH_MATES_TTL", 600)
+MAX_PREFIX = 150
+
+
+def _k_prefix(prefix: str) -> str:
+    return f"usersearch:v1:{prefix}"
+
+
+def _k_mates(user_id: int) -> str:
+    return f"usersearch:mates:v1:{user_id}"
+
+
+def normalize_prefix(q: Optional[str]) -> str:
+    return (q or "").strip().lower()[:MAX_PREFIX]
+
+
+def prefix_candidates(prefix: str) -> List[tuple]:
+    """[(user_id, username)] for usernames starting with `prefix`, alphabetical, cached."""
+    key = _k_prefix(prefix)
+    try:
+        cached = cache.get(key)
+    except Exception:
+        cached = None   # cache down: fall through to the index
+    if cached is not None:
+        return cached
+
+    # UPPER(username::text) LIKE 'AB%' ORDER BY ... COLLATE "C" LIMIT n: one walk
+    # of chat_user_username_prefix_idx, however many users share the prefix
+    order = Upper("username")
+    if connection.vendor == "postgresql":
+        order = Collate(order, "C")
+    rows = list(
+        User.objects.filter(username__istartswith=prefix, is_active=True)
+        .order_by(order)
+        .values_list("id", "username")[:USER_SEARCH_POOL]
+    )
+    try:
+        cache.set(key, rows, USER_SEARCH_CACHE_TTL)
+    except Exception:
+        pass
+    return rows
+
+
+def room_mates(user_id: int) -> List[tuple]:
+    """[(lowercased name, user_id, username, shared rooms)] for everyone in the caller's rooms, sorted, cached."""
+    room_ids = sorted(room.id for room in user_rooms.rooms_for(user_id))
+    if not room_ids:
+        return []
+    # read before the query: a change committed in between only makes the entry stale
+    stamp = membership.versions(room_ids)
+    key = _k_mates(user_id)
+    if stamp is not None:
+        try:
+            cached = cache.get(key)
+        except Exception:
+            cached = None
+        if cached is not None and cached[0] == (room_ids, stamp):
+            return cached[1]
+
+    mates = sorted(
+        (name.lower(), mate_id, name, n)
+        for mate_id, name, n in Membership.objects.filter(room_id__in=room_ids, user__is_active=True)
+        .exclude(user_id=user_id)
+        .values_list("user_id", "user__username")
+        .annotate(n=Count("room_id"))
+        .order_by()
+    )
+    if stamp is not None:
+        try:
+            cache.set(key, ((room_ids, stamp), mates), USER_SEARCH_MATES_TTL)
+        except Exception:
+            pass
+    return mates
+
+
+def _dm_partners(user_id: int, prefix: str) -> dict:
+    """{partner_id: (username, last_message_at)} for the caller's DM partners matching the prefix."""
+    partners = {}
+    threads = (
+        DirectThread.objects.filter(
+            Q(user_a_id=user_id, user_b__username__istartswith=prefix)
+            | Q(user_b_id=user_id, user_a__username__istartswith=prefix)
+        )
+        .values_list("user_a_id", "user_a__username", "user_b_id", "user_b__username", "last_message_at")
+    )
+    for a_id, a_name, b_id, b_name, last_at in threads:
+        partner_id, name = (b_id, b_name) if a_id == user_id else (a_id, a_name)
+        partners[partner_id] = (name, last_at)
+    return partners
+
+
+def search(user, q: Optional[str], room_id: Optional[int] = None, limit: int = USER_SEARCH_LIMIT) -> List[dict]:
+    """
+    Ranked matches for the caller. With `room_id` (invite form) people already
+    in that room are flagged as members and sorted last.
+    """
+    prefix = normalize_prefix(q)
+    if len(prefix) < USER_SEARCH_MIN_PREFIX:
+        return []
+
+    candidates = dict(prefix_candidates(prefix))
+    partners = _dm_partners(user.pk, prefix)
+    for partner_id, (name, _) in partners.items():
+        candidates.setdefault(partner_id, name)
+
+    # room-mates matching the prefix, with how many rooms they share with the caller
+    mates = room_mates(user.pk)
+    matching = []
+    for i in range(bisect_left(mates, (prefix,)), len(mates)):
+        if not mates[i][0].startswith(prefix):
+            break
+        matching.append(mates[i])
+    shared = {}
+    for _, mate_id, name, n in heapq.nlargest(USER_SEARCH_POOL, matching, key=lambda mate: mate[3]):
+        candidates.setdefault(mate_id, name)
+        shared[mate_id] = n
+
+    candidates.pop(user.pk, None)
+    if not candidates:
+        return []
+
+    in_room = set()
+    if room_id is not None:
+        in_room = set(
+            Membership.objects.filter(room_id=room_id, user_id__in=list(candidates)).values_list("user_id", flat=True)
+        )
+
+    def rank(item):
+        user_id, name = item
+        last_at = partners[user_id][1] if user_id in partners else None
+        return (
+            user_id in in_room,
+            name.lower() != prefix,                 # exact match first
+            user_id not in partners,
+            -(last_at.timestamp() if last_at else 0),
+            -shared.get(user_id, 0),
+            name.lower(),
+        )
+
+    return [
+        {
+            "username": name,
+            "dm": user_id in partners,
+            "shared_rooms": shared.get(user_id, 0),
+            "member": user_id in in_room,
+        }
+        for user_id, name in sorted(candidates.items(), key=rank)[:limit]
+    ]
@@ -1,7 +1,8 @@
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ObjectDoesNotExist, ValidationError
-from chat.models import DirectThread, DirectMessage
-from cryptography.fernet import Fernet
+from chat.models import DirectThread, DirectMessage, Message, get_fernet
+from chat.previews import previews, ROOM, PREVIEW_LEN
+from typing import Dict, Iterable, Optional, Tuple
 
 UserModel = get_user_model()
 
@@ -26,8 +27,50 @@ def send_direct_message(from_user, to_username, text, reply_to_id=None) -> Direc
         reply_obj = DirectMessage.objects.filter(id=reply_to_id, thread=thread).first()
     return DirectMessage.objects.create(thread=thread, sender=from_user, message=text, reply_to=reply_obj)
 
-def get_decrypted_message(message, key=None):
+def get_decrypted_message(message, key=None, previous_keys=""):
         if key:
-            fernet = Fernet(key.encode())
-            return fernet.decrypt(message.encode()).decode()
-        return message
\ No newline at end of file
+            return get_fernet(key, previous_keys).decrypt(message.encode()).decode()
+        return message
+
+
+def resolve_reply_previews(kind: str, scope_id: int, message_ids: Iterable[int]) -> Dict[int, Tuple[Optional[str], str]]:
+    """
+    Map message id -> (sender username, preview) for messages of one room/thread.
+    Served from the preview cache; misses are loaded in one query and cached.
+    """
+    found = {}
+    missing = []
+    for message_id in set(message_ids):
+        cached = previews.get(kind, message_id, scope_id)
+        if cached is None:
+            missing.append(message_id)
+        else:
+            found[message_id] = cached
+
+    if not missing:
+        return found
+
+    if kind == ROOM:
+        rows = (
+            Message.objects.filter(pk__in=missing, room_id=scope_id)
+            .select_related("sender", "room")
+            .only("id", "message", "sender__username", "room__encryption_key", "room__previous_keys")
+        )
+    else:
+        rows = (
+            DirectMessage.objects.filter(pk__in=missing, thread_id=scope_id)
+            .select_related("sender")
+            .only("id", "message", "sender__username")
+        )
+
+    for row in rows:
+        text = row.message
+        if kind == ROOM:
+            try:
+                text = row.get_decrypted_message()
+            except Exception:
+                pass
+        username = row.sender.username if row.sender_id else None
+        previews.put(kind, row.pk, scope_id, username, text)
+        found[row.pk] = (username, (text or "")[:PREVIEW_LEN])
+    return found
@@ -1,18 +1,33 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.http.response import Http404, HttpResponse, HttpResponseForbidden
-from chat.models import Room, Message, DirectThread, DirectMessage
+from chat.models import Room, Message, DirectThread, DirectMessage, DirectThreadReceipt, Upload
 from slugify import slugify
 from django.conf import settings
 from django_ratelimit.decorators import ratelimit
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import get_user_model
-from django.http import HttpRequest, HttpResponseBadRequest
+from django.http import HttpRequest, HttpResponseBadRequest, HttpResponseNotAllowed, JsonResponse, StreamingHttpResponse
+from django.template.loader import render_to_string
+from asgiref.sync import sync_to_async
 from django.core.exceptions import ValidationError
-from chat.utils import open_dm_with_username, get_decrypted_message
-from django.db.models import Q, Subquery, OuterRef
+from chat.utils import open_dm_with_username, resolve_reply_previews
+from chat.previews import previews, ROOM, DM
+from chat.registry import registry
+from chat import membership
+from chat import attachments
+from chat import user_search
+from chat import user_rooms
+from chat import inbox
+from chat.models import normalize_room_name
+from django.db import IntegrityError
+from django.db.models import Q
 
 User = get_user_model()
 
+ROOM_STREAM_HISTORY = getattr(settings, "ROOM_STREAM_HISTORY", True)
+ROOM_STREAM_CHUNK = getattr(settings, "ROOM_STREAM_CHUNK", 200)   # messages per flushed chunk
+HISTORY_MARKER = "<!--room-history-->"                             # see room.html
+
 # Create your views here.
 
 def index(request):
@@ -28,45 +43,102 @@ def room(request, room_name):
     if not request.user.is_authenticated:
         return redirect("/user/register/")
 
-    # Get room (case-insensitive), with granted users prefetched
-    try:
-        room = Room.objects.prefetch_related("granted_users").get(name__iexact=room_name)
-    except Room.DoesNotExist:
+    # Resolve the room (case-insensitive) from the registry, not a table scan
+    room = registry.resolve(room_name)
+    if room is None:
         return render(request, 'chat/404.html')
 
     # Access control (efficient membership check)
-    if not room.granted_users.filter(pk=request.user.pk).exists():
+    if not membership.is_member(room.id, request.user.pk):
         return render(request, 'chat/404.html')
 
+    context = {
+        "room_name": room.name,
+        "room_slug": room.slug,
+        "username": str(request.user.username),
+        "users": User.objects.filter(room__id=room.id).exclude(pk=request.user.pk).values('username')
+    }
+
+    # Streaming: send the page shell now, then history as the cursor yields it
+    if request.GET.get("stream", "1" if ROOM_STREAM_HISTORY else "0") != "0":
+        page = render_to_string("chat/room.html", {**context, "streaming": True}, request=request)
+        head, tail = page.split(HISTORY_MARKER, 1)
+        response = StreamingHttpResponse(
+            stream_room_history(room, head, tail, context["username"]),
+            content_type="text/html; charset=utf-8",
+        )
+        response["X-Accel-Buffering"] = "no"   # or nginx holds the page until the end
+        return response
+
+    messages = list(room_history(room))
+    prepare_room_messages(messages, room)
+    return render(request, "chat/room.html", {**context, "messages": messages})
+
+
+def room_history(room):
     # Pull messages with everything the template needs (efficiently)
-    messages_qs = (
-        Message.objects.filter(room=room)
-        .select_related("room", "sender", "reply_to", "reply_to__sender")
+    return (
+        Message.objects.filter(room_id=room.id)
+        .select_related("sender", "attachment")
         .order_by("created_at")
     )
 
-    # Decrypt text for display while keeping model instances
-    messages = list(messages_qs)
+
+def prepare_room_messages(messages, room, prev_date=None):
+    """
+    Decrypt, cache previews, attach reply stubs and date separators for a run
+    of consecutive history messages. Returns the last message's date so the
+    next chunk continues the separators.
+    """
+    fernet = room.fernet()
     for m in messages:
         try:
             # Show decrypted message in the template via {{ message.message }}
-            m.message = m.get_decrypted_message()
-            if m.reply_to:
-                m.reply_to.message = m.reply_to.get_decrypted_message()
+            m.message = fernet.decrypt(m.message.encode()).decode()
         except Exception:
             # Fallback to stored (possibly plaintext) value
             pass
-
-    return render(
-        request,
-        "chat/room.html",
-        {
-            "room_name": room.name,
-            "messages": messages,                 # model instances (reply_to available)
-            "username": str(request.user.username),
-            "users": room.granted_users.exclude(pk=request.user.pk).values('username')
-        },
-    )
+        previews.put(ROOM, m.pk, room.id, m.sender.username if m.sender_id else None, m.message)
+        if m.attachment_id:
+            m.attachment_info = attachments.attachment_payload("room", m.pk, m.attachment, m.attachment_name)
+        day = m.created_at.date()
+        m.show_date = day != prev_date
+        prev_date = day
+
+    # Reply stubs come from the preview cache (most parents were streamed already)
+    attach_reply_previews(messages, ROOM, room.id)
+    return prev_date
+
+
+def _render_history_chunk(messages, room, username, prev_date):
+    prev_date = prepare_room_messages(messages, room, prev_date)
+    html = render_to_string("chat/_room_messages.html", {"messages": messages, "username": username})
+    return html, prev_date
+
+
+async def stream_room_history(room, head, tail, username):
+    """Page shell, then one rendered chunk per ROOM_STREAM_CHUNK messages, then the scripts."""
+    yield head
+    chunk, prev_date = [], None
+    # server-side cursor on Postgres; at most one chunk of rows is held in memory
+    async for message in room_history(room).aiterator(chunk_size=ROOM_STREAM_CHUNK):
+        chunk.append(message)
+        if len(chunk) >= ROOM_STREAM_CHUNK:
+            html, prev_date = await sync_to_async(_render_history_chunk)(chunk, room, username, prev_date)
+            yield html
+            chunk = []
+    if chunk:
+        html, prev_date = await sync_to_async(_render_history_chunk)(chunk, room, username, prev_date)
+        yield html
+    yield tail
+
+
+def attach_reply_previews(messages, kind, scope_id):
+    """Set reply_username / reply_preview on each message that is a reply."""
+    resolved = resolve_reply_previews(kind, scope_id, [m.reply_to_id for m in messages if m.reply_to_id])
+    for m in messages:
+        if m.reply_to_id:
+            m.reply_username, m.reply_preview = resolved.get(m.reply_to_id, (None, ""))
 
 
 def home_redirect(request):
@@ -82,10 +154,17 @@ def create_room(request, room_name):
     if prefetched_room.filter(creator=request.user).count() >= settings.MAXIMUM_ROOM_ALLOWED:
         return HttpResponseForbidden(f"You have created maximum {settings.MAXIMUM_ROOM_ALLOWED} rooms before!")
     
-    if prefetched_room.filter(name=room_name).exists():
+    if not normalize_room_name(room_name):
+        return HttpResponseBadRequest("invalid room name")
+
+    if registry.resolve(room_name) is not None:
         return HttpResponseForbidden("this room exists!")
     
-    room = Room.objects.create(name=slugify(text=room_name), creator=request.user)
+    try:
+        room = Room.objects.create(name=slugify(text=room_name), creator=request.user)
+    except IntegrityError:
+        # created concurrently; the unique slug index has the final word
+        return HttpResponseForbidden("this room exists!")
     room.granted_users.set([request.user])
 
 
@@ -95,27 +174,27 @@ def user_rooms_list(request):
     if not request.user.is_authenticated:
         return redirect("/user/register/")
     
-    rooms = Room.objects.prefetch_related("granted_users").filter(granted_users__in=[request.user]).all()
+    rooms = user_rooms.rooms_for(request.user.pk)
     return render(request, "chat/invite.html", context={"rooms": rooms})
 
 def user_invite(request):
     if not request.user.is_authenticated:
         return redirect("/user/register/")
     
-    room_pk = request.POST.get("room")
-    username = request.POST.get("username")
-    room = Room.objects.prefetch_related("granted_users").get(pk=room_pk, granted_users__in=[request.user])
     try:
-        user = User.objects.get(username=username)
-    except User.DoesNotExist:
+        room_pk = int(request.POST.get("room"))
+    except (TypeError, ValueError):
+        return HttpResponseBadRequest("invalid room")
+    username = request.POST.get("username") or ""
+    # membership check, user lookup and insert in one statement
+    result = user_rooms.invite(room_pk, request.user.pk, username)
+    if result == user_rooms.NOT_MEMBER:
+        return HttpResponseForbidden("you are not a member of this room!")
+    if result == user_rooms.NO_SUCH_USER:
         return HttpResponse("this User does not exist!")
+    if result == user_rooms.ALREADY_MEMBER:
+        return HttpResponse("this User is already a member of the room.")
 
-    try:
-        room.granted_users.add(user)
-        room.save()
-    except:
-        return HttpResponse("something went wrong!")
-    
     return HttpResponse("the User has been Invited successfully :)")
 
 
@@ -134,42 +213,163 @@ def dm_room_view(request: HttpRequest, room_name: str):
     thread = DirectThread.objects.get(uuid=room_name)
     if request.user.id not in (thread.user_a_id, thread.user_b_id):
         return HttpResponseBadRequest("Forbidden")
-    messages_qs = thread.messages.select_related("sender", "reply_to", "reply_to__sender").order_by("created_at", "id")[:200]
+    # newest 200, oldest first; the socket's `sync` picks up from the last one
+    messages_qs = list(thread.messages.select_related("sender", "attachment").order_by("-id")[:200])[::-1]
+    for m in messages_qs:
+        previews.put(DM, m.pk, thread.pk, m.sender.username, m.message)
+        if m.attachment_id:
+            m.attachment_info = attachments.attachment_payload("dm", m.pk, m.attachment, m.attachment_name)
+    attach_reply_previews(messages_qs, DM, thread.pk)
+    peer_receipt = (
+        DirectThreadReceipt.objects.filter(thread=thread)
+        .exclude(user_id=request.user.id)
+        .values("delivered_up_to", "read_up_to")
+        .first()
+    ) or {"delivered_up_to": 0, "read_up_to": 0}
     context = {
         "room_name": str(thread.uuid),
         "username": request.user.username,
         "other_user": thread.user_b if thread.user_a_id == request.user.id else thread.user_a,
         "messages": messages_qs,
+        "peer_receipt": peer_receipt,
     }
     return render(request, "chat/one-to-one.html", context)
 
 
 @login_required(login_url='/user/login/')
 def chats_homepage(request):
-    user = request.user
+    # first inbox page only; the rest is fetched from inbox_api as the list scrolls
+    items, next_cursor = inbox.page(request.user)
+    return render(request, 'chat/homepage.html', context={'inbox': {'items': items, 'next': next_cursor}})
 
-    rooms = Room.objects.filter(granted_users=user).annotate(
-        last_message=Subquery(
-            Message.objects.filter(room_id=OuterRef('pk')).order_by('-created_at').values('message')[:1]
-        )
-    )
 
-    chats = DirectThread.objects.filter(
-        Q(user_a=user) |
-        Q(user_b=user)
-    ).annotate(
-        last_message=Subquery(
-            DirectMessage.objects.filter(thread_id=OuterRef('pk')).order_by('-created_at').values('message')[:1]
-        )
-    )
+@login_required
+def inbox_api(request: HttpRequest):
+    """GET ?cursor=<next from the previous page>&limit=N -> {"items": [...], "next": cursor or null}."""
+    cursor = None
+    if request.GET.get("cursor"):
+        cursor = inbox.parse_cursor(request.GET["cursor"])
+        if cursor is None:
+            return HttpResponseBadRequest("invalid cursor")
+    try:
+        limit = int(request.GET.get("limit", inbox.INBOX_PAGE_SIZE))
+    except ValueError:
+        return HttpResponseBadRequest("invalid limit")
+    items, next_cursor = inbox.page(request.user, cursor, limit)
+    return JsonResponse({"items": items, "next": next_cursor})
 
-    rooms = list(rooms)
-    for room in rooms:
-        room.last_message = get_decrypted_message(room.last_message, room.encryption_key)
 
-    return render(request, 'chat/homepage.html', context={'rooms': rooms, 'chats': chats})
+@login_required
+def user_start_chat(request: HttpRequest):
+    return render(request, "chat/start_chat.html")
 
 
 @login_required
-def user_start_chat(request: HttpRequest):
-    return render(request, "chat/start_chat.html")
\ No newline at end of file
+@ratelimit(key="user", rate="120/m")
+def user_search_view(request: HttpRequest):
+    """Username autocomplete (start chat / invite); ?room=<id> flags people already in that room."""
+    room_id = None
+    if request.GET.get("room"):
+        try:
+            room_id = int(request.GET["room"])
+        except ValueError:
+            return HttpResponseBadRequest("invalid room")
+        if not membership.is_member(room_id, request.user.pk):
+            room_id = None   # don't reveal who is in rooms the caller can't see
+    return JsonResponse({"results": user_search.search(request.user, request.GET.get("q"), room_id)})
+
+
+# ---------- Attachments ----------
+
+def _upload_status(upload):
+    return {
+        "upload": str(upload.pk),
+        "offset": upload.received,
+        "size": upload.size,
+        "complete": upload.attachment_id is not None,
+        "chunk_size": attachments.ATTACHMENT_CHUNK_SIZE,
+    }
+
+
+@login_required
+@ratelimit(key="user_or_ip", rate="30/m")
+def attachment_upload_start(request: HttpRequest):
+    """Open an upload for a room (slug) or DM thread (uuid) the user belongs to."""
+    if request.method != "POST":
+        return HttpResponseNotAllowed(["POST"])
+    try:
+        size = int(request.POST.get("size"))
+    except (TypeError, ValueError):
+        return HttpResponseBadRequest("invalid size")
+    if not 0 < size <= attachments.ATTACHMENT_MAX_SIZE:
+        return JsonResponse({"error": "too_large", "max_size": attachments.ATTACHMENT_MAX_SIZE}, status=413)
+    filename = (request.POST.get("filename") or "").replace("\\", "/").rsplit("/", 1)[-1][:255] or "file"
+
+    room_id = thread_id = None
+    if request.POST.get("room"):
+        room = registry.resolve(request.POST["room"])
+        if room is None or not membership.is_member(room.id, request.user.pk):
+            return HttpResponseForbidden("Forbidden")
+        room_id = room.id
+    elif request.POST.get("thread"):
+        try:
+            thread_id = (
+                DirectThread.objects.filter(uuid=request.POST["thread"])
+                .filter(Q(user_a=request.user) | Q(user_b=request.user))
+                .values_list("id", flat=True)
+                .first()
+            )
+        except ValidationError:
+            thread_id = None
+        if thread_id is None:
+            return HttpResponseForbidden("Forbidden")
+    else:
+        return HttpResponseBadRequest("room or thread is required")
+
+    upload = Upload.objects.create(user=request.user, room_id=room_id, thread_id=thread_id, filename=filename, size=size)
+    return JsonResponse(_upload_status(upload), status=201)
+
+
+@login_required
+def attachment_upload(request: HttpRequest, upload_id):
+    """GET: how much the server has (resume point). PUT: append a chunk at Upload-Offset."""
+    if request.method == "GET":
+        upload = Upload.objects.filter(pk=upload_id, user=request.user).first()
+        if upload is None:
+            return JsonResponse({"error": "unknown upload"}, status=404)
+        return JsonResponse(_upload_status(upload))
+    if request.method != "PUT":
+        return HttpResponseNotAllowed(["GET", "PUT"])
+
+    try:
+        offset = int(request.headers.get("Upload-Offset", ""))
+    except ValueError:
+        return HttpResponseBadRequest("Upload-Offset header is required")
+    try:
+        # the body is streamed to disk in blocks, never read whole
+        upload = attachments.write_chunk(upload_id, request.user.pk, offset, request)
+    except attachments.UploadError as exc:
+        return JsonResponse({"error": str(exc), "offset": exc.offset}, status=exc.status)
+    return JsonResponse(_upload_status(upload))
+
+
+@login_required
+def attachment_download(request: HttpRequest, kind: str, message_id: int):
+    if kind == "room":
+        message = Message.objects.filter(pk=message_id, attachment__isnull=False).select_related("attachment").first()
+        allowed = message is not None and membership.is_member(message.room_id, request.user.pk)
+    elif kind == "dm":
+        message = (
+            DirectMessage.objects.filter(pk=message_id, attachment__isnull=False)
+            .filter(Q(thread__user_a=request.user) | Q(thread__user_b=request.user))
+            .select_related("attachment")
+            .first()
+        )
+        allowed = message is not None
+    else:
+        allowed = False
+    if not allowed:
+        raise Http404
+
+    thumbnail = request.GET.get("thumb") == "1" and message.attachment.has_thumbnail
+    return attachments.serve(message.attachment, message.attachment_name, thumbnail=thumbnail)
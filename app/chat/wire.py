@@ -0,0 +1,39 @@
+"""
+Wire encoding for the websocket consumers.
+
+Browsers keep talking JSON text frames. Clients that offer the
+`djchat.msgpack.v1` subprotocol in the handshake get msgpack-encoded binary
+frames both ways instead, which is smaller and cheaper to encode/decode.
+"""
+import json
+from typing import Any, Optional
+
+import msgpack
+
+MSGPACK_SUBPROTOCOL = "djchat.msgpack.v1"
+
+
+def negotiate_subprotocol(scope) -> Optional[str]:
+    """Pick the subprotocol to accept with, or None for plain JSON."""
+    if MSGPACK_SUBPROTOCOL in (scope.get("subprotocols") or ()):
+        return MSGPACK_SUBPROTOCOL
+    return None
+
+
+def encode(payload: Any, binary: bool) -> dict:
+    """Keyword arguments for `consumer.send()`."""
+    if binary:
+        return {"bytes_data": msgpack.packb(payload, use_bin_type=True)}
+    return {"text_data": json.dumps(payload)}
+
+
+def decode(text_data: Optional[str] = None, bytes_data: Optional[bytes] = None) -> Optional[dict]:
+    """Parse one inbound frame; None if it isn't a JSON/msgpack object."""
+    try:
+        if bytes_data is not None:
+            data = msgpack.unpackb(bytes_data, raw=False)
+        else:
+            data = json.loads(text_data or "{}")
+    except (ValueError, msgpack.UnpackException):
+        return None
+    return data if isinstance(data, dict) else None
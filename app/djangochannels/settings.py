@@ -50,6 +50,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'chat.profiling.ProfileMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -74,15 +75,83 @@ TEMPLATES = [
 
 ASGI_APPLICATION = 'djangochannels.asgi.application'
 
+# Rooms and DMs get separate layers so their per-channel queues can be sized
+# independently: room events fan out to many sockets and are only useful for a
+# short while, DM events go to two users and are worth keeping a little longer.
 CHANNEL_LAYERS = {
     "default": {
         "BACKEND": "channels_redis.core.RedisChannelLayer",
         "CONFIG": {
             "hosts": ["redis://redis:6379/2"],
+            "capacity": 300,          # messages per channel before ChannelFull
+            "expiry": 30,             # seconds an undelivered message is kept
+            "group_expiry": 86400,
+        },
+    },
+    "dm": {
+        "BACKEND": "channels_redis.core.RedisChannelLayer",
+        "CONFIG": {
+            "hosts": ["redis://redis:6379/2"],
+            "prefix": "asgi_dm",
+            "capacity": 100,
+            "expiry": 60,
+            "group_expiry": 86400,
+        },
+    },
+    # group_send is one PUBLISH instead of one list push per member channel;
+    # no capacity/expiry (at-most-once, clients catch up with the `sync` action)
+    "pubsub": {
+        "BACKEND": "channels_redis.pubsub.RedisPubSubChannelLayer",
+        "CONFIG": {
+            "hosts": ["redis://redis:6379/2"],
+            "prefix": "asgi_ps",
         },
     },
 }
 
+# Channel layer alias per group prefix: "chat_" is rooms, "dm_" is direct
+# threads. Big rooms: CHAT_CHANNEL_LAYER=pubsub (compare with `manage.py bench_fanout`).
+CHANNEL_LAYER_BY_PREFIX = {
+    "chat_": os.environ.get("CHAT_CHANNEL_LAYER", "default"),
+    "dm_": os.environ.get("DM_CHANNEL_LAYER", "dm"),
+    "inbox_": os.environ.get("INBOX_CHANNEL_LAYER", "default"),
+}
+
+# Per-socket outbound buffer (see chat/outbound.py).
+# policy: "drop_oldest" | "coalesce" | "disconnect"
+WS_OUTBOUND = {
+    "chat": {"max_frames": 256, "policy": "drop_oldest"},
+    "dm": {"max_frames": 128, "policy": "coalesce"},
+    "inbox": {"max_frames": 64, "policy": "coalesce"},
+}
+
+# Token buckets for inbound websocket messages (see chat/throttle.py),
+# per user and room/thread. rate = tokens per second, burst = bucket size.
+WS_RATE_LIMITS = {
+    "chat": {"rate": 1.0, "burst": 10},
+    "dm": {"rate": 2.0, "burst": 20},
+    # reconnect catch-up pages, kept apart from messages so typing or chatting
+    # can't starve it; the burst covers a full catch-up (SYNC_MAX / SYNC_BATCH pages)
+    "sync": {"rate": 2.0, "burst": 10},
+}
+
+# Record inbound websocket frames (text redacted) as NDJSON for `manage.py
+# replay_ws` (see chat/capture.py). Off unless WS_CAPTURE_PATH is set;
+# "{pid}" in the path gives each worker its own file.
+WS_CAPTURE_PATH = os.environ.get("WS_CAPTURE_PATH") or None
+WS_CAPTURE_SAMPLE = float(os.environ.get("WS_CAPTURE_SAMPLE", "1.0"))
+
+# Staff-only sampling profiler (see chat/profiling.py): ?_profile=1 on a page,
+# {"action": "profile", "messages": N} on a socket. Folded stacks land in PROFILE_DIR.
+PROFILING_ENABLED = os.environ.get("PROFILING_ENABLED") == "1"
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "/tmp/djchat-profiles")
+
+# SIGTERM drains sockets instead of dropping them (see chat/drain.py): clients
+# are told to come back after a random 1-15 s. Keep DRAIN_TIMEOUT below the
+# container's stop_grace_period.
+DRAIN_TIMEOUT = 20
+DRAIN_RECONNECT_MS = (1000, 15000)
+
 # WSGI_APPLICATION = 'djangochannels.wsgi.application'
 
 
@@ -144,6 +213,26 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 MAXIMUM_ROOM_ALLOWED:int = 1
 
+# Room pages send the shell first and stream history in chunks (?stream=0 to opt out)
+ROOM_STREAM_HISTORY = True
+ROOM_STREAM_CHUNK = 200
+
+# Homepage inbox (see chat/inbox.py): conversations per page, and how stale a
+# room's last_message_at may get before a message rewrites it (and pushes).
+INBOX_PAGE_SIZE = 30
+ROOM_ACTIVITY_RESOLUTION = 5
+
+# Attachments live on local disk, content-addressed (see chat/attachments.py).
+# nginx serves them from the same directory via X-Accel-Redirect; set
+# ATTACHMENT_X_ACCEL=0 when running without nginx.
+ATTACHMENT_ROOT = os.environ.get("ATTACHMENT_ROOT", str(BASE_DIR / "attachments"))
+ATTACHMENT_X_ACCEL = os.environ.get("ATTACHMENT_X_ACCEL", "1") == "1"
+ATTACHMENT_X_ACCEL_PREFIX = "/protected-attachments/"
+ATTACHMENT_MAX_SIZE = 50 * 1024 * 1024
+ATTACHMENT_CHUNK_SIZE = 4 * 1024 * 1024
+ATTACHMENT_THUMB_SIZE = (320, 320)
+ATTACHMENT_THUMB_WORKERS = 2
+
 CACHES = {
     "default": {
         "BACKEND": "django_redis.cache.RedisCache",